@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+
+"""
+End-to-end build benchmark for pdf2video.
+Author: T. Junttila
+License: The MIT License
+
+Generates a synthetic PDF presentation and script file, and runs the full
+pdf2video build against a local fake Polly server that returns silent MP3
+audio and evenly spaced speech marks after a configurable latency.
+The cold-cache, warm-cache and one-page-edited scenarios are timed, and
+the per-stage and total times are printed as JSON, for instance
+
+  python3 benchmarks/bench_build.py --pages 40 --latency 0.3 -o result.json
+
+The options after "--" are passed to pdf2video, so for instance the
+per-segment and the single-process assembly of a deck of many short pages
+can be compared with
+
+  python3 benchmarks/bench_build.py --pages 100 --lines 1 -- --assembly single
+
+Requires the same tools as pdf2video itself (poppler utils, FFmpeg, and
+boto3 or the AWS command line tool), but no AWS account.
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+import re
+import shutil
+from socketserver import ThreadingMixIn
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# A silent MPEG 2 Layer III frame: 48 kbit/s, 22050 Hz, mono
+MP3_FRAME = bytes([0xff, 0xf3, 0x60, 0xc4]) + bytes(72 * 48000 // 22050 - 4)
+MP3_FRAME_SECONDS = 576 / 22050
+
+WORDS = ['slide', 'video', 'narration', 'example', 'algorithm', 'value',
+         'function', 'graph', 'result', 'theorem', 'proof', 'structure']
+
+
+def make_pdf(file_name, nof_pages):
+    """Write a simple PDF file with a numbered title on each page."""
+    objects = []
+    def add(obj):
+        objects.append(obj)
+        return len(objects)
+    catalog = add(None)
+    pages = add(None)
+    font = add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+    kids = []
+    for page_num in range(1, nof_pages+1):
+        content = (f'BT /F1 48 Tf 72 400 Td (Slide {page_num}) Tj ET\n'
+                   f'0.2 0.4 0.8 rg 72 {100 + 7 * page_num % 200} '
+                   f'{200 + 13 * page_num % 400} 40 re f\n').encode('ascii')
+        stream = add(b'<< /Length %d >>\nstream\n' % len(content) +
+                     content + b'endstream')
+        kids.append(add(b'<< /Type /Page /Parent %d 0 R '
+                        b'/MediaBox [0 0 960 540] '
+                        b'/Resources << /Font << /F1 %d 0 R >> >> '
+                        b'/Contents %d 0 R >>' % (pages, font, stream)))
+    objects[catalog-1] = b'<< /Type /Catalog /Pages %d 0 R >>' % pages
+    objects[pages-1] = (b'<< /Type /Pages /Count %d /Kids [' % nof_pages +
+                        b' '.join(b'%d 0 R' % kid for kid in kids) + b'] >>')
+    data = b'%PDF-1.4\n'
+    offsets = []
+    for (number, obj) in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b'%d 0 obj\n' % number + obj + b'\nendobj\n'
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects)+1)
+    for offset in offsets:
+        data += b'%010d 00000 n \n' % offset
+    data += (b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+             % (len(objects)+1, catalog, xref))
+    with open(file_name, 'wb') as file_handle:
+        file_handle.write(data)
+
+
+def make_script(file_name, nof_pages, nof_lines, line_words, edited_page=None):
+    """
+    Write a script file with the given number of #pages, lines per page,
+    and words per line. If edited_page is given, one line of that #page
+    is changed.
+    """
+    with open(file_name, 'w', encoding='utf-8') as file_handle:
+        for page_num in range(1, nof_pages+1):
+            file_handle.write(f'#page p{page_num}\n')
+            for line_num in range(nof_lines):
+                words = [WORDS[(page_num * 7 + line_num * 3 + i) % len(WORDS)]
+                         for i in range(line_words)]
+                if page_num == edited_page and line_num == 0:
+                    words.append('edited')
+                file_handle.write(f'This is *line* {line_num+1} about ' +
+                                  ' '.join(words) + '.\n')
+            file_handle.write('#5\n\n')
+
+
+class FakePolly(ThreadingMixIn, HTTPServer):
+    """
+    A local HTTP server imitating the Polly SynthesizeSpeech API.
+    Each line of text takes seconds_per_line of audio.
+    """
+    daemon_threads = True
+    def __init__(self, latency, seconds_per_line):
+        super().__init__(('127.0.0.1', 0), FakePollyHandler)
+        self.latency = latency
+        self.seconds_per_line = seconds_per_line
+        self.requests = 0
+        self.lock = threading.Lock()
+    @property
+    def url(self):
+        """The endpoint URL of the server."""
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class FakePollyHandler(BaseHTTPRequestHandler):
+    """The request handler of FakePolly."""
+    def log_message(self, *args):
+        pass
+    def do_POST(self):
+        """Handle a SynthesizeSpeech request."""
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length).decode('utf-8'))
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+        marks = re.findall(r'<mark name="([se]\d+)"/>', request['Text'])
+        nof_lines = max(1, len(marks) // 2)
+        duration = nof_lines * self.server.seconds_per_line + 0.2
+        if request.get('OutputFormat') == 'json':
+            lines = []
+            for (number, mark) in enumerate(marks):
+                # Evenly spaced lines, each line spoken for 90% of its slot
+                slot = number // 2
+                offset = 0.9 if mark.startswith('e') else 0.0
+                time_ms = int(1000 * (0.2 + (slot + offset) *
+                                      self.server.seconds_per_line))
+                lines.append(json.dumps({'time': time_ms, 'type': 'ssml',
+                                         'start': 0, 'end': 0,
+                                         'value': mark}))
+            body = ('\n'.join(lines) + '\n').encode('utf-8')
+            content_type = 'application/x-json-stream'
+        else:
+            body = MP3_FRAME * int(duration / MP3_FRAME_SECONDS)
+            content_type = 'audio/mpeg'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('x-amzn-RequestCharacters', str(len(request['Text'])))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def stage_times(trace_file):
+    """Sum the durations of the top-level stage spans in the trace, in seconds."""
+    with open(trace_file, 'r', encoding='utf-8') as file_handle:
+        events = json.load(file_handle)['traceEvents']
+    times = {}
+    for event in events:
+        if event['cat'] == 'stage':
+            times[event['name']] = times.get(event['name'], 0) + event['dur'] / 1e6
+    return times
+
+
+def git_revision():
+    """The current git commit of the repository, if available."""
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=True)
+        return result.stdout.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """The main routine."""
+    argp = argparse.ArgumentParser(
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter,
+        description = 'Benchmark pdf2video builds with a fake Polly.')
+    argp.add_argument('--pages', type=int, default=20,
+                      help='the number of pages in the synthetic deck')
+    argp.add_argument('--lines', type=int, default=6,
+                      help='the number of script lines per page')
+    argp.add_argument('--line_words', type=int, default=12,
+                      help='the number of words per script line')
+    argp.add_argument('--latency', type=float, default=0.2,
+                      help='the fake Polly latency per request in seconds')
+    argp.add_argument('--seconds_per_line', type=float, default=3.0,
+                      help='the fake audio duration per script line')
+    argp.add_argument('--repeat', type=int, default=1,
+                      help='the number of times each scenario is run')
+    argp.add_argument('--work_dir', default=None,
+                      help='the working directory (default: a temporary one)')
+    argp.add_argument('--output', '-o', default=None,
+                      help='write the JSON results to the file')
+    argp.add_argument('options', nargs=argparse.REMAINDER,
+                      help='extra options passed to pdf2video')
+    args = argp.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='pdf2video-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    pdf_file = os.path.join(work_dir, 'deck.pdf')
+    script_file = os.path.join(work_dir, 'script.txt')
+    cache_dir = os.path.join(work_dir, 'cache')
+    make_pdf(pdf_file, args.pages)
+
+    server = FakePolly(args.latency, args.seconds_per_line)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = dict(os.environ, AWS_ACCESS_KEY_ID='fake', AWS_SECRET_ACCESS_KEY='fake',
+               AWS_DEFAULT_REGION='us-east-1')
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+        ([env['PYTHONPATH']] if 'PYTHONPATH' in env else []))
+    options = [option for option in args.options if option != '--']
+
+    def run(scenario):
+        trace_file = os.path.join(work_dir, f'{scenario}.json')
+        cmd = [sys.executable, '-m', 'pdf2video', '--quiet',
+               '--audio_cache', cache_dir,
+               '--temp_prefix', os.path.join(work_dir, 'temp'),
+               '--polly_endpoint', server.url, '--profile', trace_file,
+               *options, pdf_file, script_file,
+               os.path.join(work_dir, 'video.mp4')]
+        requests_before = server.requests
+        start = time.perf_counter()
+        result = subprocess.run(cmd, env=env, cwd=work_dir,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        total = time.perf_counter() - start
+        if result.returncode != 0:
+            sys.exit(f'pdf2video failed in the {scenario} scenario:\n' +
+                     result.stderr.decode('utf-8'))
+        return {'total': total, 'stages': stage_times(trace_file),
+                'tts_requests': server.requests - requests_before}
+
+    results = {}
+    for repetition in range(args.repeat):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        make_script(script_file, args.pages, args.lines, args.line_words)
+        runs = [('cold', run('cold')), ('warm', run('warm'))]
+        make_script(script_file, args.pages, args.lines, args.line_words,
+                    edited_page=(args.pages + 1) // 2)
+        runs.append(('edited', run('edited')))
+        for (scenario, timing) in runs:
+            results.setdefault(scenario, []).append(timing)
+    server.shutdown()
+
+    report = {'commit': git_revision(),
+              'config': {'pages': args.pages, 'lines': args.lines,
+                         'line_words': args.line_words,
+                         'latency': args.latency,
+                         'seconds_per_line': args.seconds_per_line,
+                         'options': options},
+              'scenarios': {scenario: {'total': min(run['total'] for run in runs),
+                                       'runs': runs}
+                            for (scenario, runs) in results.items()}}
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as file_handle:
+            file_handle.write(text + '\n')
+    print(text)
+    if args.work_dir is None:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
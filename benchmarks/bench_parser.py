@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+"""
+Script parser scaling benchmark for pdf2video.
+Author: T. Junttila
+License: The MIT License
+
+Times parse_to_ast on increasingly long lines full of modifiers and
+prints the time per character for each length as JSON, together with
+the fitted scaling exponent (1.0 for linear time), for instance
+
+  python3 benchmarks/bench_parser.py --max_length 100000
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pdf2video.parser import parse_to_ast
+
+PATTERNS = {
+    'modifiers': '*very* #sub/big-#ph!Theta!Ti:.t@! of n/Θ(n)/, #slow/x y/ '
+                 '#low|down| #high/up/ @abc@ -1 #5 ',
+    'words': 'word, another word; and -42 more words! ',
+    'nested': '#sub/#slow!#high|*a b*|!/s/ ',
+}
+
+
+def time_parse(line, repeat):
+    """The best time of parsing the line in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse_to_ast(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """The main routine."""
+    argp = argparse.ArgumentParser(
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter,
+        description = 'Benchmark the scaling of the script parser.')
+    argp.add_argument('--min_length', type=int, default=1000,
+                      help='the shortest line length in characters')
+    argp.add_argument('--max_length', type=int, default=64000,
+                      help='the longest line length in characters')
+    argp.add_argument('--repeat', type=int, default=3,
+                      help='the number of timings per line, the best is used')
+    args = argp.parse_args()
+
+    results = {}
+    for (name, pattern) in PATTERNS.items():
+        points = []
+        length = args.min_length
+        while length <= args.max_length:
+            # Whole repetitions only, not to end in the middle of a modifier
+            line = pattern * max(1, length // len(pattern))
+            seconds = time_parse(line, args.repeat)
+            points.append({'length': len(line), 'seconds': seconds,
+                           'ns_per_char': 1e9 * seconds / len(line)})
+            length *= 2
+        # Least squares fit of log(time) = exponent * log(length) + c
+        xs = [math.log(point['length']) for point in points]
+        ys = [math.log(point['seconds']) for point in points]
+        x_mean = sum(xs) / len(xs)
+        y_mean = sum(ys) / len(ys)
+        exponent = (sum((x - x_mean) * (y - y_mean) for (x, y) in zip(xs, ys)) /
+                    max(1e-12, sum((x - x_mean) ** 2 for x in xs)))
+        results[name] = {'exponent': exponent, 'points': points}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Building many videos described in a manifest file.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sys
+import threading
+import time
+
+from .cache import CacheIndex, parse_age, parse_size
+from .pdf2video import BuildError, BuildPools, build, cpu_count, \
+    encoder_plan, make_arg_parser
+from .profiling import Profiler
+
+def read_manifest(file_name):
+    """
+    Read a JSON or TOML (by the file name extension) manifest file.
+    Reading TOML requires Python 3.11 or the tomli package.
+    """
+    if file_name.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError('Reading TOML manifests requires ' \
+                                 'Python 3.11 or the tomli package')
+        with open(file_name, 'rb') as file_handle:
+            manifest = tomllib.load(file_handle)
+    else:
+        with open(file_name, 'r', encoding='utf-8') as file_handle:
+            manifest = json.load(file_handle)
+    if not isinstance(manifest, dict) or \
+       not isinstance(manifest.get('jobs'), list):
+        raise ValueError('The manifest should have a list of "jobs"')
+    return manifest
+
+# The pdf2video options that apply to the whole batch, given as the
+# options of "pdf2video batch" instead, or not supported in a batch
+BATCH_OPTIONS = {'jobs': '--jobs', 'tts_jobs': '--tts_jobs',
+                 'tts_rate': '--tts_rate', 'profile': '--profile',
+                 'cache_max_size': '--cache_max_size',
+                 'cache_max_age': '--cache_max_age', 'watch': None}
+
+def options_to_argv(options):
+    """
+    Convert a dictionary of option names and values to command line
+    arguments: true adds a flag, false and null are omitted, and lists
+    are joined with commas.
+    """
+    argv = []
+    for (name, value) in options.items():
+        if value is None or value is False:
+            continue
+        argv.append('--'+name)
+        if isinstance(value, list):
+            argv.append(','.join(str(item) for item in value))
+        elif value is not True:
+            argv.append(str(value))
+    return argv
+
+def job_argv(manifest, job):
+    """The command line arguments of a job in the manifest."""
+    options = dict(manifest.get('options', {}))
+    options.update(job.get('options', {}))
+    for name in options:
+        if name not in BATCH_OPTIONS:
+            continue
+        if BATCH_OPTIONS[name] is None:
+            raise ValueError(f'The option "{name}" is not supported in a batch')
+        raise ValueError(f'The option "{name}" applies to the whole batch, ' \
+                         f'give it as "pdf2video batch {BATCH_OPTIONS[name]}"')
+    for key in ['pdf_file', 'script_file', 'output_file']:
+        if key not in job:
+            raise ValueError(f'The job has no "{key}"')
+    return options_to_argv(options) + \
+        [job['pdf_file'], job['script_file'], job['output_file']]
+
+def batch_main(argv):
+    """
+    The main routine of the "pdf2video batch" command.
+    Returns the exit status: 0 if all the jobs succeeded.
+    """
+    argp = argparse.ArgumentParser(
+        prog='pdf2video batch',
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter,
+        description = 'Build the videos listed in a JSON or TOML manifest. ' \
+        'The manifest has a list of "jobs", each with a "pdf_file", ' \
+        'a "script_file", an "output_file", and optionally a dictionary of ' \
+        'pdf2video "options" (for instance {"voice": "Matthew", ' \
+        '"neural": true}). The top-level "options" apply to all the jobs. ' \
+        'The jobs share the worker pools and the cache, and a failing job ' \
+        'does not stop the others.')
+    argp.add_argument('--builds', metavar='N', type=int, default=4,
+                   help='the number of jobs built concurrently')
+    argp.add_argument('--jobs', metavar='N', type=int, default=0,
+                   help='the number of pages encoded concurrently over ' \
+                   'all the jobs (0: one per CPU)')
+    argp.add_argument('--tts_jobs', metavar='N', type=int, default=4,
+                   help='the maximum number of concurrent TTS requests ' \
+                   'over all the jobs')
+    argp.add_argument('--tts_rate', metavar='R', type=float, default=8,
+                   help='the maximum number of TTS requests started per ' \
+                   'second over all the jobs (0 for no limit)')
+    argp.add_argument('--cache_max_size', metavar='S', type=parse_size,
+                   default=None, help='after the jobs, evict the least ' \
+                   'recently used cache files until the cache is at most ' \
+                   'this large (for instance 500M or 10G)')
+    argp.add_argument('--cache_max_age', metavar='A', type=parse_age,
+                   default=None, help='after the jobs, evict the cache ' \
+                   'files not used within this time (for instance 12h or 30d)')
+    argp.add_argument('--profile', metavar='F', default=None,
+                   help='write the timings of all the jobs to the file in ' \
+                   'the Chrome trace event format, and print a summary table')
+    argp.add_argument('--quiet', action='store_true',
+                   help='only print the job results')
+    argp.add_argument('manifest', help='the manifest file (.json or .toml)')
+    args = argp.parse_args(argv)
+
+    try:
+        manifest = read_manifest(args.manifest)
+    except (IOError, ValueError) as err:
+        argp.exit(1, f'Could not read the manifest "{args.manifest}": {err}\n')
+
+    profiler = Profiler(enabled=args.profile is not None)
+    pools = BuildPools(cpu_count(), args.tts_jobs, args.tts_rate,
+                       *encoder_plan(args.jobs, cpu_count()))
+    # The cache indices shared by the jobs, by the cache directory
+    caches = {}
+    caches_lock = threading.Lock()
+    print_lock = threading.Lock()
+    def report(name, msg):
+        with print_lock:
+            print(f'[{name}] {msg}')
+            sys.stdout.flush()
+
+    batch_start = time.time()
+    def run(number, job):
+        # Returns the name of the job and whether it succeeded
+        name = str(job.get('name', number+1) if isinstance(job, dict)
+                   else number+1)
+        try:
+            job_args = make_arg_parser().parse_args(job_argv(manifest, job))
+        except (ValueError, TypeError, AttributeError) as err:
+            report(name, f'FAILED: invalid job: {err}')
+            return (name, False)
+        except SystemExit:
+            # The argument parser has already printed the error
+            report(name, 'FAILED: invalid options')
+            return (name, False)
+        # Concurrent jobs must not share the temporary files
+        job_args.temp_prefix = f'{job_args.temp_prefix}-{number+1}'
+        job_args.quiet = job_args.quiet or args.quiet
+        cache_dir = os.path.abspath(job_args.audio_cache)
+        with caches_lock:
+            if cache_dir not in caches:
+                caches[cache_dir] = CacheIndex(job_args.audio_cache)
+            cache = caches[cache_dir]
+        def verbose(msg):
+            if not job_args.quiet:
+                report(name, msg)
+        start = time.perf_counter()
+        try:
+            with profiler.span('build', job=name):
+                build(job_args, pools, cache, profiler, verbose)
+        except (BuildError, OSError) as err:
+            report(name, f'FAILED: {err}')
+            return (name, False)
+        except Exception as err:
+            # An unexpected error only fails the job, not the whole batch
+            report(name, f'FAILED: {type(err).__name__}: {err}')
+            return (name, False)
+        finally:
+            # The cache directory is not made if the job fails early
+            if os.path.isdir(job_args.audio_cache):
+                try:
+                    cache.save()
+                except OSError as err:
+                    report(name, f'Could not save the cache index: {err}')
+        report(name, f'built "{job_args.output_file}" in ' \
+                     f'{time.perf_counter() - start:.1f}s')
+        return (name, True)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.builds)) as executor:
+        futures = [executor.submit(run, number, job)
+                   for (number, job) in enumerate(manifest['jobs'])]
+        failures = [name for (name, succeeded) in
+                    (future.result() for future in futures) if not succeeded]
+    pools.shutdown()
+
+    # Keep the caches within the size and age limits
+    if args.cache_max_size is not None or args.cache_max_age is not None:
+        for cache in caches.values():
+            cache.gc(args.cache_max_size, args.cache_max_age,
+                     keep=cache.accessed_since(batch_start))
+            cache.save()
+    if args.profile is not None:
+        profiler.write_chrome_trace(args.profile)
+        print(profiler.summary())
+    print(f'{len(futures) - len(failures)} of {len(futures)} jobs built' +
+          (f', failed: {", ".join(failures)}' if failures else ''))
+    return 1 if failures else 0
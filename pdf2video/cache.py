@@ -0,0 +1,227 @@
+"""
+The index of the pdf2video cache directory.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+
+INDEX_FILE = 'index.json'
+# Held by the processes updating the index file
+LOCK_FILE = 'index.json.lock'
+
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+AGE_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def parse_size(text):
+    """Parse a size like "500M" or "10G" to bytes."""
+    match = re.match(r'^\s*(\d+(\.\d+)?)\s*([KMGT]?)i?B?\s*$', text, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f'Invalid size "{text}"')
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(3).upper()])
+
+def parse_age(text):
+    """Parse an age like "12h" or "30d" to seconds."""
+    match = re.match(r'^\s*(\d+(\.\d+)?)\s*([smhdw]?)\s*$', text)
+    if match is None:
+        raise ValueError(f'Invalid age "{text}"')
+    return float(match.group(1)) * AGE_UNITS[match.group(3)]
+
+def format_size(size):
+    """Format a size in bytes in a human readable form."""
+    for unit in ['', 'K', 'M', 'G']:
+        if size < 1024:
+            return f'{size:.1f}{unit}B' if unit != '' else f'{size}B'
+        size /= 1024
+    return f'{size:.1f}TB'
+
+class CacheIndex:
+    """
+    An index of the files in a cache directory, recording for each file
+    its size, the time of the last access, and its origin.
+    The files are identified by their paths relative to the directory.
+    Lookups only consult the index, so the files in the directory must
+    be added and removed through it; verify() drops the entries of the
+    files removed by other means.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.entries = {}
+        # The files added or accessed, and the files removed,
+        # through this index since it was last read or saved
+        self.changed = set()
+        self.removed = set()
+        self.load()
+
+    def path(self, name):
+        """The path of the cached file."""
+        return os.path.join(self.directory, name)
+
+    def _read_index(self):
+        try:
+            with open(self.path(INDEX_FILE), 'r', encoding='utf-8') as file_handle:
+                entries = json.load(file_handle)['entries']
+            if isinstance(entries, dict):
+                return entries
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the lock of the index file, shared with the other processes."""
+        with open(self.path(LOCK_FILE), 'a', encoding='utf-8') as file_handle:
+            try:
+                import fcntl
+            except ImportError:
+                # Not available on Windows, where the index is not locked
+                fcntl = None
+            if fcntl is not None:
+                fcntl.flock(file_handle, fcntl.LOCK_EX)
+            yield
+
+    def load(self):
+        """Read the index, or rebuild it from the files if it is missing."""
+        entries = self._read_index()
+        with self.lock:
+            if entries is None:
+                self.entries = self._scan()
+            else:
+                self.entries = entries
+
+    def _scan(self):
+        entries = {}
+        for (dir_name, _, file_names) in os.walk(self.directory):
+            for file_name in file_names:
+                path = os.path.join(dir_name, file_name)
+                name = os.path.relpath(path, self.directory)
+                if name in (INDEX_FILE, LOCK_FILE) or '.part' in file_name:
+                    continue
+                stat = os.stat(path)
+                entries[name] = {'size': stat.st_size,
+                                 'atime': stat.st_mtime,
+                                 'origin': 'unknown'}
+        return entries
+
+    def lookup(self, name):
+        """Is the file in the cache? If so, mark it accessed now."""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return False
+            entry['atime'] = time.time()
+            self.changed.add(name)
+            return True
+
+    def add(self, name, origin=''):
+        """Add a file written to the cache directory to the index."""
+        size = os.path.getsize(self.path(name))
+        with self.lock:
+            self.entries[name] = {'size': size, 'atime': time.time(),
+                                  'origin': origin}
+            self.changed.add(name)
+            self.removed.discard(name)
+
+    def remove(self, name):
+        """Remove a file from the cache."""
+        with self.lock:
+            self.entries.pop(name, None)
+            self.changed.discard(name)
+            self.removed.add(name)
+        try:
+            os.unlink(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def save(self):
+        """
+        Write the index, merging it with the index written by other
+        processes since this index was read: only the files added,
+        accessed or removed through this index are updated, so that
+        the files removed by the others are not brought back.
+        The index file is locked while it is read, merged and replaced.
+        """
+        with self._locked(), self.lock:
+            on_disk = self._read_index()
+            if on_disk is not None:
+                for name in self.removed:
+                    on_disk.pop(name, None)
+                for name in self.changed:
+                    own = self.entries.get(name)
+                    other = on_disk.get(name)
+                    if own is None:
+                        continue
+                    if other is None or other['atime'] < own['atime']:
+                        on_disk[name] = own
+                self.entries = on_disk
+            self.changed = set()
+            self.removed = set()
+            data = {'version': 1, 'entries': self.entries}
+            part_file = self.path(INDEX_FILE)+f'.{os.getpid()}.part'
+            with open(part_file, 'w', encoding='utf-8') as file_handle:
+                json.dump(data, file_handle, indent=0, sort_keys=True)
+            os.replace(part_file, self.path(INDEX_FILE))
+
+    def verify(self):
+        """Drop the entries whose files have been removed from the directory."""
+        with self.lock:
+            names = list(self.entries)
+        missing = [name for name in names if not os.path.isfile(self.path(name))]
+        for name in missing:
+            self.remove(name)
+        return missing
+
+    def stats(self):
+        """
+        Get the statistics of the cache as a dictionary
+        mapping the kind of files to (number of files, total size) pairs.
+        """
+        result = {}
+        with self.lock:
+            for (name, entry) in self.entries.items():
+                kind = os.path.join(os.path.dirname(name),
+                                    '*'+os.path.splitext(name)[1])
+                (count, size) = result.get(kind, (0, 0))
+                result[kind] = (count + 1, size + entry['size'])
+        return result
+
+    def accessed_since(self, since):
+        """The set of files accessed or added at or after the time."""
+        with self.lock:
+            return {name for (name, entry) in self.entries.items()
+                    if entry['atime'] >= since}
+
+    def total_size(self):
+        """The total size of the cached files in bytes."""
+        with self.lock:
+            return sum(entry['size'] for entry in self.entries.values())
+
+    def gc(self, max_size=None, max_age=None, keep=()):
+        """
+        Evict the files not accessed in max_age seconds, and then the least
+        recently used files until the total size is at most max_size bytes.
+        The files in keep are never evicted.
+        Returns the list of evicted files.
+        """
+        now = time.time()
+        with self.lock:
+            lru = sorted(self.entries.items(), key=lambda item: item[1]['atime'])
+        total = sum(entry['size'] for (_, entry) in lru)
+        evicted = []
+        for (name, entry) in lru:
+            if name in keep:
+                continue
+            too_old = max_age is not None and now - entry['atime'] > max_age
+            too_big = max_size is not None and total > max_size
+            if not (too_old or too_big):
+                continue
+            self.remove(name)
+            total -= entry['size']
+            evicted.append(name)
+        return evicted
@@ -0,0 +1,85 @@
+"""
+HTTP Live Streaming (HLS) playlists for pdf2video.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import os
+
+from .subtitles import millis_to_vtt
+
+# The presentation time (in seconds) of the start of the video in the
+# transport streams, leaving room for the audio encoder priming
+HLS_START = 1.4
+
+def _write_atomically(file_name, text):
+    """Write the file under a temporary name first, so readers see it whole."""
+    part_file = file_name+'.part'
+    with open(part_file, 'w', encoding='utf-8') as file_handle:
+        file_handle.write(text)
+    os.replace(part_file, file_name)
+
+def write_master_playlist(file_name, media_uri, subtitles_uri=None,
+                          bandwidth=2000000):
+    """
+    Write the master playlist referring to the media playlist and,
+    if given, the WebVTT subtitles playlist.
+    """
+    text = '#EXTM3U\n#EXT-X-VERSION:3\n'
+    stream_info = f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth}'
+    if subtitles_uri is not None:
+        text += '#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="subs",NAME="English",' \
+                'LANGUAGE="en",DEFAULT=YES,AUTOSELECT=YES,' \
+                f'URI="{subtitles_uri}"\n'
+        stream_info += ',SUBTITLES="subs"'
+    text += stream_info + '\n' + media_uri + '\n'
+    _write_atomically(file_name, text)
+
+def write_media_playlist(file_name, target_duration, segments, ended):
+    """
+    Write a media playlist of the (duration in seconds, URI) pairs.
+    Until the playlist is ended, players keep polling it for new segments.
+    """
+    text = '#EXTM3U\n#EXT-X-VERSION:3\n' \
+           f'#EXT-X-TARGETDURATION:{target_duration}\n' \
+           '#EXT-X-MEDIA-SEQUENCE:0\n#EXT-X-PLAYLIST-TYPE:EVENT\n'
+    for (duration, uri) in segments:
+        text += f'#EXTINF:{duration:.3f},\n{uri}\n'
+    if ended:
+        text += '#EXT-X-ENDLIST\n'
+    _write_atomically(file_name, text)
+
+def read_media_playlist(file_name):
+    """Read the (duration in seconds, URI) pairs of a media playlist."""
+    segments = []
+    duration = None
+    with open(file_name, 'r', encoding='utf-8') as file_handle:
+        for line in file_handle:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line != '' and not line.startswith('#'):
+                segments.append((duration, line))
+    return segments
+
+def write_vtt_segment(cues, start, end, file_name):
+    """
+    Write the cues overlapping the time range from start to end
+    (in milliseconds from the start of the video) to a WebVTT segment
+    synchronized with the transport streams. The file is only rewritten
+    if its contents change.
+    """
+    text = 'WEBVTT\n' \
+           f'X-TIMESTAMP-MAP=MPEGTS:{round(HLS_START * 90000)},' \
+           'LOCAL:00:00:00.000\n\n'
+    for cue in cues:
+        if cue.end > start and cue.start < end:
+            text += millis_to_vtt(cue.start)+' --> '+millis_to_vtt(cue.end)+'\n'
+            text += cue.text+'\n\n'
+    try:
+        with open(file_name, 'r', encoding='utf-8') as file_handle:
+            if file_handle.read() == text:
+                return
+    except IOError:
+        pass
+    _write_atomically(file_name, text)
@@ -0,0 +1,101 @@
+"""
+Reading MP3 file properties without decoding the audio.
+Author: T. Junttila
+License: The MIT License
+"""
+
+# Layer III bitrates in kbit/s, indexed by the bitrate index
+BITRATES_MPEG1 = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224,
+                  256, 320]
+BITRATES_MPEG2 = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128,
+                  144, 160]
+
+# Sampling rates indexed by the version bits and the sampling rate index
+SAMPLE_RATES = {3: [44100, 48000, 32000],  # MPEG 1
+                2: [22050, 24000, 16000],  # MPEG 2
+                0: [11025, 12000, 8000]}   # MPEG 2.5
+
+def _id3v2_size(data):
+    """The size of the ID3v2 tag at the beginning of the data (0 if none)."""
+    if len(data) < 10 or data[0:3] != b'ID3':
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7f)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+def _frame_header(data, pos):
+    """
+    Parse the Layer III frame header at the position.
+    Returns the tuple (frame length, samples, sampling rate),
+    or None if there is no valid header at the position.
+    """
+    if pos + 4 > len(data) or data[pos] != 0xff or (data[pos+1] & 0xe0) != 0xe0:
+        return None
+    version = (data[pos+1] >> 3) & 0x03
+    layer = (data[pos+1] >> 1) & 0x03
+    bitrate_index = (data[pos+2] >> 4) & 0x0f
+    rate_index = (data[pos+2] >> 2) & 0x03
+    padding = (data[pos+2] >> 1) & 0x01
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    if version == 3:
+        bitrate = BITRATES_MPEG1[bitrate_index] * 1000
+        samples = 1152
+    else:
+        bitrate = BITRATES_MPEG2[bitrate_index] * 1000
+        samples = 576
+    length = (samples // 8) * bitrate // sample_rate + padding
+    return (length, samples, sample_rate)
+
+def mp3_frames(data):
+    """
+    Get the audio frames in the MP3 data as a list of
+    (position, length, samples, sampling rate) tuples.
+    ID3 tags and a Xing/Info header frame are not included.
+    """
+    frames = []
+    pos = _id3v2_size(data)
+    while pos + 4 <= len(data):
+        header = _frame_header(data, pos)
+        if header is None:
+            # Not in sync, for instance an ID3v1 tag or garbage
+            pos += 1
+            continue
+        (length, samples, sample_rate) = header
+        if len(frames) == 0 and (b'Xing' in data[pos:pos+64] or
+                                 b'Info' in data[pos:pos+64]):
+            # A VBR header frame contains no audio
+            pos += length
+            continue
+        frames.append((pos, length, samples, sample_rate))
+        pos += length
+    return frames
+
+def mp3_duration(file_name):
+    """The duration of the MP3 file in seconds."""
+    with open(file_name, 'rb') as file_handle:
+        data = file_handle.read()
+    return sum(samples / sample_rate
+               for (_, _, samples, sample_rate) in mp3_frames(data))
+
+def concatenate_mp3(input_files, output_file):
+    """
+    Concatenate the audio frames of the MP3 files losslessly into the
+    output file, leaving out their ID3 tags and VBR header frames.
+    The files should have the same sampling rate and number of channels.
+    Returns the durations of the input files in seconds.
+    """
+    durations = []
+    with open(output_file, 'wb') as output_handle:
+        for file_name in input_files:
+            with open(file_name, 'rb') as file_handle:
+                data = file_handle.read()
+            frames = mp3_frames(data)
+            for (pos, length, _, _) in frames:
+                output_handle.write(data[pos:pos+length])
+            durations.append(sum(samples / sample_rate
+                                 for (_, _, samples, sample_rate) in frames))
+    return durations
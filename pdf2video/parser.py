@@ -6,280 +6,263 @@ License: The MIT License
 
 from abc import ABC, abstractmethod
 import re
-import sys
+
+class ParseError(Exception):
+    """A syntax error in a script line."""
 
 class AST(ABC):
     """Base class for abstract syntax tree nodes."""
+    __slots__ = ()
 
     @abstractmethod
+    def emit(self, neural, ssml, words, sub):
+        """
+        Append the SSML, plain words, and sub-titles representations
+        of the sub-tree to the three lists in a single traversal.
+        """
+
     def to_ssml(self, neural):
         """Get the SSML representation of the sub-tree."""
+        ssml = []
+        self.emit(neural, ssml, [], [])
+        return ''.join(ssml)
 
-    @abstractmethod
     def to_words(self):
         """Get the plain words representation of the sub-tree."""
+        words = []
+        self.emit(False, [], words, [])
+        return words
 
-    @abstractmethod
     def to_sub(self):
         """Get the sub-titles representation of the sub-tree."""
+        sub = []
+        self.emit(False, [], [], sub)
+        return ''.join(sub)
 
 class ASTWord(AST):
     """An AST node for a word."""
+    __slots__ = ('text',)
     def __init__(self, text):
         super().__init__()
         self.text = text
-    def to_ssml(self, neural):
-        return self.text
-    def to_words(self):
-        return [self.text]
-    def to_sub(self):
-        return self.text
+    def emit(self, neural, ssml, words, sub):
+        ssml.append(self.text)
+        words.append(self.text)
+        sub.append(self.text)
 
 class ASTBreak(AST):
     """An AST node for a break."""
+    __slots__ = ('time',)
     def __init__(self, time):
         self.time = time
-    def to_ssml(self, neural):
-        return '<break time="'+str(self.time*100)+'ms" />'
-    def to_words(self):
-        return []
-    def to_sub(self):
-        return ''
+    def emit(self, neural, ssml, words, sub):
+        ssml.append('<break time="'+str(self.time*100)+'ms" />')
 
 class ASTDelim(AST):
     """An AST node for a delimiter."""
+    __slots__ = ('text',)
     def __init__(self, text):
         self.text = text
-    def to_ssml(self, neural):
-        return self.text
-    def to_words(self):
-        return []
-    def to_sub(self):
-        return self.text
+    def emit(self, neural, ssml, words, sub):
+        ssml.append(self.text)
+        sub.append(self.text)
 
 class ASTSpace(AST):
     """An AST node for a white space."""
+    __slots__ = ()
     def __init__(self):
         pass
-    def to_ssml(self, neural):
-        return ' '
-    def to_words(self):
-        return []
-    def to_sub(self):
-        return ' '
+    def emit(self, neural, ssml, words, sub):
+        ssml.append(' ')
+        sub.append(' ')
 
 class ASTEmph(AST):
     """An AST node for emphasized text."""
+    __slots__ = ('children',)
     def __init__(self, children):
         self.children = children
-    def to_ssml(self, neural):
-        children_ssml = "".join([child.to_ssml(neural) for child in self.children])
+    def emit(self, neural, ssml, words, sub):
         if neural:
-            return '<prosody rate="90%" volume="loud">'+children_ssml+'</prosody>'
-        return '<prosody pitch="high" volume="loud">'+children_ssml+'</prosody>'
-    def to_words(self):
-        result = []
+            ssml.append('<prosody rate="90%" volume="loud">')
+        else:
+            ssml.append('<prosody pitch="high" volume="loud">')
         for child in self.children:
-            result += child.to_words()
-        return result
-    def to_sub(self):
-        return "".join([child.to_sub() for child in self.children])
+            child.emit(neural, ssml, words, sub)
+        ssml.append('</prosody>')
 
 class ASTPhoneme(AST):
     """An AST node for text read with phonemes."""
+    __slots__ = ('text', 'xsampa')
     def __init__(self, text, xsampa):
         self.text = text
         self.xsampa = xsampa
-    def to_ssml(self, neural):
-        return f'<phoneme alphabet="x-sampa" ph="{self.xsampa}">{self.text}</phoneme>'
-    def to_words(self):
-        return re.split(r'\s+', self.text.strip())
-    def to_sub(self):
-        return self.text
+    def emit(self, neural, ssml, words, sub):
+        ssml.append(f'<phoneme alphabet="x-sampa" ph="{self.xsampa}">{self.text}</phoneme>')
+        words.extend(re.split(r'\s+', self.text.strip()))
+        sub.append(self.text)
 
 class ASTSub(AST):
     """An AST node for text with different sub-title representation."""
+    __slots__ = ('children', 'subtitles')
     def __init__(self, children, subtitles):
         self.children = children
         self.subtitles = subtitles
-    def to_ssml(self, neural):
-        children_ssml = [child.to_ssml(neural) for child in self.children]
-        return "".join(children_ssml)
-    def to_words(self):
-        result = []
+    def emit(self, neural, ssml, words, sub):
+        # The sub-titles of the children are replaced
+        children_sub = []
         for child in self.children:
-            result += child.to_words()
-        return result
-    def to_sub(self):
-        return self.subtitles
+            child.emit(neural, ssml, words, children_sub)
+        sub.append(self.subtitles)
 
 class ASTSlow(AST):
     """An AST node for text read slowly."""
+    __slots__ = ('children',)
     def __init__(self, children):
         self.children = children
-    def to_ssml(self, neural):
-        children_ssml = "".join([child.to_ssml(neural) for child in self.children])
-        return '<prosody rate="80%">'+children_ssml+'</prosody>'
-    def to_words(self):
-        result = []
+    def emit(self, neural, ssml, words, sub):
+        ssml.append('<prosody rate="80%">')
         for child in self.children:
-            result += child.to_words()
-        return result
-    def to_sub(self):
-        return "".join([child.to_sub() for child in self.children])
+            child.emit(neural, ssml, words, sub)
+        ssml.append('</prosody>')
 
 class ASTLow(AST):
     """An AST node for text read in low pitch."""
+    __slots__ = ('children',)
     def __init__(self, children):
         self.children = children
-    def to_ssml(self, neural):
-        children_ssml = "".join([child.to_ssml(neural) for child in self.children])
-        if neural:
-            # prosody pitch not yet in neural TTS, make it slightly slower
-            return '<prosody rate="80%">'+children_ssml+'</prosody>'
-        return '<prosody pitch="low">'+children_ssml+'</prosody>'
-    def to_words(self):
-        result = []
+    def emit(self, neural, ssml, words, sub):
+        # prosody pitch not yet in neural TTS, make it slightly slower
+        ssml.append('<prosody rate="80%">' if neural else '<prosody pitch="low">')
         for child in self.children:
-            result += child.to_words()
-        return result
-    def to_sub(self):
-        return "".join([child.to_sub() for child in self.children])
+            child.emit(neural, ssml, words, sub)
+        ssml.append('</prosody>')
 
 class ASTHigh(AST):
     """An AST node for text read in high pitch."""
+    __slots__ = ('children',)
     def __init__(self, children):
         self.children = children
-    def to_ssml(self, neural):
-        children_ssml = "".join([child.to_ssml(neural) for child in self.children])
-        if neural:
-            # prosody pitch not yet in neural TTS, make it slightly faster
-            return '<prosody rate="120%">'+children_ssml+'</prosody>'
-        return '<prosody pitch="high">'+children_ssml+'</prosody>'
-    def to_words(self):
-        result = []
+    def emit(self, neural, ssml, words, sub):
+        # prosody pitch not yet in neural TTS, make it slightly faster
+        ssml.append('<prosody rate="120%">' if neural else '<prosody pitch="high">')
         for child in self.children:
-            result += child.to_words()
-        return result
-    def to_sub(self):
-        return "".join([child.to_sub() for child in self.children])
+            child.emit(neural, ssml, words, sub)
+        ssml.append('</prosody>')
 
 class ASTSayAs(AST):
     """An AST node for text read as letters."""
+    __slots__ = ('letters',)
     def __init__(self, letters):
         self.letters = letters
-    def to_ssml(self, neural):
-        return '<say-as interpret-as="characters">'+self.letters+'</say-as>'
-    def to_words(self):
-        return re.split(r'\s+', self.letters.strip())
-    def to_sub(self):
-        return self.letters
+    def emit(self, neural, ssml, words, sub):
+        ssml.append('<say-as interpret-as="characters">'+self.letters+'</say-as>')
+        words.extend(re.split(r'\s+', self.letters.strip()))
+        sub.append(self.letters)
 
 
+# Precompiled patterns of the script syntax, matched at an offset of the line
+SUB_RE = re.compile(r'#sub(.)(?P<text>.*?)\1(?P<sub>.+?)\1')
+SLOW_RE = re.compile(r'#slow(.)(?P<text>.+?)\1')
+LOW_RE = re.compile(r'#low(.)(?P<text>.+?)\1')
+HIGH_RE = re.compile(r'#high(.)(?P<text>.+?)\1')
+PH_RE = re.compile(r'#ph(.)(?P<text>.+?)\1(?P<ph>.+?)\1')
+BREAK_RE = re.compile(r'#(?P<time>\d+)')
+EMPH_RE = re.compile(r'\*(?P<text>[^\*]+)\*')
+SAYAS_RE = re.compile(r'@(?P<text>[^@]+)@')
+SPACE_RE = re.compile(r'\s+')
+NEGATIVE_RE = re.compile(r'-\d+')
+DELIM_RE = re.compile(r'[-.,:;!?"]')
+WORD_RE = re.compile(r'[^ \t#*@".,:;!?]+')
+
 def parse_to_ast(string, err_linenum = None):
-    """Parse the script text string into a sequence of AST nodes."""
+    """
+    Parse the script text string into a sequence of AST nodes.
+    The string is scanned once from left to right, matching the
+    precompiled patterns at the current offset without copying the
+    rest of the string.
+    Raises ParseError if the string is malformed.
+    """
     i = 0
     string_length = len(string)
-    def read_until(chars):
-        nonlocal i
-        tmp = i
-        while i < string_length and string[i] not in chars:
-            i += 1
-        return string[tmp:i]
     def err(msg):
         linenum_text = '' if err_linenum is None else f'On line {err_linenum}: '
-        print(linenum_text+msg)
-        sys.exit(1)
-        #assert False, msg
+        raise ParseError(linenum_text+msg)
     result = []
     while i < string_length:
-        if string[i] == '#':
-            if string[i:i+4] == '#sub':
-                match = re.match(
-                    '^#sub(.)(?P<text>((?!\1).)*?)\\1(?P<sub>((?!\1).)+?)\\1',
-                    string[i:])
+        char = string[i]
+        if char == '#':
+            if string.startswith('#sub', i):
+                match = SUB_RE.match(string, i)
                 if match is None:
                     err(f'Malformed #sub "{string[i:]}"')
-                result.append(ASTSub(parse_to_ast(match['text']), match['sub']))
-                i += len(match.group(0))
-                continue
-            if string[i:i+5] == '#slow':
-                match = re.match('^#slow(.)(?P<text>((?!\1).)+?)\\1', string[i:])
+                result.append(ASTSub(parse_to_ast(match['text'], err_linenum),
+                                     match['sub']))
+            elif string.startswith('#slow', i):
+                match = SLOW_RE.match(string, i)
                 if match is None:
                     err(f'Malformed #slow "{string[i:]}"')
-                result.append(ASTSlow(parse_to_ast(match['text'])))
-                i += len(match.group(0))
-                continue
-            if string[i:i+4] == '#low':
-                match = re.match('^#low(.)(?P<text>((?!\1).)+?)\\1', string[i:])
+                result.append(ASTSlow(parse_to_ast(match['text'], err_linenum)))
+            elif string.startswith('#low', i):
+                match = LOW_RE.match(string, i)
                 if match is None:
                     err(f'Malformed #low "{string[i:]}"')
-                result.append(ASTLow(parse_to_ast(match['text'])))
-                i += len(match.group(0))
-                continue
-            if string[i:i+5] == '#high':
-                match = re.match('^#high(.)(?P<text>((?!\1).)+?)\\1', string[i:])
+                result.append(ASTLow(parse_to_ast(match['text'], err_linenum)))
+            elif string.startswith('#high', i):
+                match = HIGH_RE.match(string, i)
                 if match is None:
                     err(f'Malformed #high "{string[i:]}"')
-                result.append(ASTHigh(parse_to_ast(match['text'])))
-                i += len(match.group(0))
-                continue
-            if string[i:i+3] == '#ph':
-                match = re.match(
-                    '^#ph(.)(?P<text>((?!\1).)+?)\\1(?P<ph>((?!\1).)+?)\\1',
-                    string[i:])
+                result.append(ASTHigh(parse_to_ast(match['text'], err_linenum)))
+            elif string.startswith('#ph', i):
+                match = PH_RE.match(string, i)
                 if match is None:
                     err(f'Malformed #ph "{string[i:]}"')
                 result.append(ASTPhoneme(match['text'], match['ph']))
-                i += len(match.group(0))
-                continue
-            # Break #10
-            match = re.match(r'^#(?P<time>\d+)', string[i:])
-            if match:
+            else:
+                # Break #10
+                match = BREAK_RE.match(string, i)
+                if match is None:
+                    err(f'Unrecognized script command "{string[i:]}"')
                 result.append(ASTBreak(int(match['time'])))
-                i += len(match.group(0))
-                continue
-            err(f'Unrecognized script command "{string[i:]}"')
-        elif string[i] == '*':
-            match = re.match(r'^\*(?P<text>[^\*]+)\*', string[i:])
+        elif char == '*':
+            match = EMPH_RE.match(string, i)
             if match is None:
                 err(f'Malformed emphasis "{string[i:]}"')
-            result.append(ASTEmph(parse_to_ast(match['text'])))
-            i += len(match.group(0))
-        elif string[i] == '@':
-            match = re.match(r'^@(?P<text>[^@]+)@', string[i:])
+            result.append(ASTEmph(parse_to_ast(match['text'], err_linenum)))
+        elif char == '@':
+            match = SAYAS_RE.match(string, i)
             if match is None:
                 err(f'Malformed say-as "{string[i:]}"')
             result.append(ASTSayAs(match['text']))
-            i += len(match.group(0))
         else:
-            match = re.match(r'^\s+', string[i:])
+            match = SPACE_RE.match(string, i)
             if match:
                 result.append(ASTSpace())
-                i += len(match.group(0))
-                continue
-            # Negative numbers are words
-            match = re.match(r'^-\d+', string[i:])
-            if match:
-                result.append(ASTWord(match.group(0)))
-                i += len(match.group(0))
-                continue
-            # Delimiters
-            match = re.match('^[-.,:;!?"]', string[i:])
-            if match:
-                result.append(ASTDelim(match.group(0)))
-                i += len(match.group(0))
-                continue
-            word = read_until([' ','\t','#','*','@','"','.',',',':',';','!','?'])
-            result.append(ASTWord(word))
+            else:
+                # Negative numbers are words
+                match = NEGATIVE_RE.match(string, i)
+                if match:
+                    result.append(ASTWord(match.group(0)))
+                else:
+                    # Delimiters
+                    match = DELIM_RE.match(string, i)
+                    if match:
+                        result.append(ASTDelim(match.group(0)))
+                    else:
+                        match = WORD_RE.match(string, i)
+                        result.append(ASTWord(match.group(0)))
+        i = match.end()
     return result
 
-def parse(string, neural):
-    """Parse a script text line."""
-    ast = parse_to_ast(string)
-    ssml = "".join([node.to_ssml(neural) for node in ast])
+def parse(string, neural, err_linenum = None):
+    """
+    Parse a script text line.
+    Returns the SSML, the plain words, and the sub-titles of the line,
+    all produced in a single traversal of the syntax tree.
+    """
+    ast = parse_to_ast(string, err_linenum)
+    ssml = []
     words = []
+    sub = []
     for node in ast:
-        words += node.to_words()
-    sub = "".join([node.to_sub() for node in ast])
-    return (ssml, words, sub)
+        node.emit(neural, ssml, words, sub)
+    return ("".join(ssml), words, "".join(sub))
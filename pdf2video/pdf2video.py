@@ -9,19 +9,35 @@ Requires:
 - pdfinfo
 - pdftoppm
 - ffmpeg
-- access to Amazon Web Services with a Polly-enabled profile
+- access to Amazon Web Services with a Polly-enabled profile,
+  or espeak-ng for offline draft narration
 """
 
 import argparse
+from concurrent.futures import Future, ThreadPoolExecutor
 import hashlib
-import json
+import itertools
+import math
 import os
 import re
+import shutil
 import subprocess
 from subprocess import PIPE
 import sys
+import threading
+import time
 
-from .parser import parse_to_ast, parse
+from .cache import CacheIndex, format_size, parse_age, parse_size
+from .hls import HLS_START, read_media_playlist, write_master_playlist, \
+    write_media_playlist, write_vtt_segment
+from .mp3 import concatenate_mp3, mp3_duration
+from .parser import ParseError, parse
+from .profiling import Profiler
+from .subtitles import Cue, MARK_TYPES, WRITERS, concatenate_cues, \
+    join_timings, read_speech_marks, read_timings, write_srt, write_timings
+from .scheduler import Scheduler
+from .tts import EspeakNG, TTSError, TokenBucket, make_polly_client, \
+    synthesize
 
 voices = ['Zeina', 'Zhiyu', 'Naja', 'Mads', 'Lotte', 'Ruben', 'Nicole',
           'Russell', 'Amy', 'Emma', 'Brian', 'Aditi', 'Raveena', 'Ivy',
@@ -40,25 +56,39 @@ voices_neural = ['Amy', 'Emma', 'Brian', 'Ivy', 'Joanna', 'Kendra',
 
 voices_conversational = ['Joanna', 'Matthew', 'Lupe']
 
-def millis_to_srt(millis):
-    """Convert milliseconds time to the SRT subtitles format time string."""
-    result = ''
-    # milliseconds
-    milliseconds = millis % 1000
-    result = ('%03d' % milliseconds) + result
-    millis = (millis - milliseconds) / 1000
-    # seconds
-    seconds = millis % 60
-    result = ('%02d,' % seconds) + result
-    millis = (millis - seconds) / 60
-    # minutes
-    minutes = millis % 60
-    result = ('%02d:' % minutes) + result
-    millis = (millis - minutes) / 60
-    # hours
-    result = ('%02d:' % millis) + result
-    # ready
-    return result
+# The default voices of the TTS backends
+default_voices = {'polly': 'Joanna', 'espeak-ng': 'en-us'}
+
+# The interval of checking the input files for changes in the watch mode
+WATCH_INTERVAL = 0.5
+
+def cpu_count():
+    """The number of CPUs available to this process."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def encoder_plan(jobs, nof_segments):
+    """
+    Split the CPUs between concurrent encoder processes.
+    Returns the pair (number of concurrent encoders, threads per encoder).
+    If jobs is not positive, one encoder per CPU is used.
+    """
+    cpus = cpu_count()
+    workers = jobs if jobs > 0 else cpus
+    workers = max(1, min(workers, nof_segments))
+    threads = max(1, cpus // workers)
+    return (workers, threads)
+
+
+def tts_workers(args):
+    """
+    The number of concurrent TTS requests: limited for Polly,
+    but the offline backend can run on all the CPUs.
+    """
+    return args.tts_jobs if args.tts == 'polly' else cpu_count()
 
 
 def parse_page_range(args, execute, error):
@@ -221,62 +251,449 @@ def read_scripts(script_file, error):
     return (scripts, scripts_names)
 
 
-def script_to_ssml_and_hash(script, args):
+def page_batches(page_nums, nof_workers):
+    """
+    Group the distinct page numbers into ranges (first, last) of contiguous
+    pages so that each range can be rendered with one pdftoppm run.
+    Long ranges are split so that all the workers get something to do.
+    """
+    page_nums = sorted(set(page_nums))
+    if len(page_nums) == 0:
+        return []
+    batch_size = max(1, -(-len(page_nums) // max(1, nof_workers)))
+    batches = []
+    first = last = page_nums[0]
+    for num in page_nums[1:]:
+        if num == last + 1 and num - first < batch_size:
+            last = num
+            continue
+        batches.append((first, last))
+        first = last = num
+    batches.append((first, last))
+    return batches
+
+
+def file_hash(file_name, hash_value=None):
+    """Update the hash (a new SHA-256 hash by default) with the file contents."""
+    if hash_value is None:
+        hash_value = hashlib.sha256()
+    with open(file_name, 'rb') as file_handle:
+        for chunk in iter(lambda: file_handle.read(1 << 20), b''):
+            hash_value.update(chunk)
+    return hash_value
+
+
+def _hash_pdf_object(obj, hash_value, seen, skip_keys=('/Parent', '/Length')):
+    """
+    Update the hash with a pypdf object and the objects it refers to,
+    leaving out the dictionary entries with the keys in skip_keys.
+    """
+    if hasattr(obj, 'idnum'):
+        # An indirect reference
+        reference = (obj.idnum, obj.generation)
+        obj = obj.get_object()
+        # Reference numbers change between exports, so only use them
+        # for not visiting shared objects twice
+        if reference in seen:
+            hash_value.update(b'seen')
+            return
+        seen.add(reference)
+    if hasattr(obj, 'get_data'):
+        hash_value.update(b'stream')
+        hash_value.update(obj.get_data())
+    if isinstance(obj, dict):
+        hash_value.update(b'dict')
+        for key in sorted(obj.keys()):
+            if key in skip_keys:
+                continue
+            hash_value.update(str(key).encode('utf-8'))
+            value = obj.raw_get(key) if hasattr(obj, 'raw_get') else obj[key]
+            _hash_pdf_object(value, hash_value, seen, skip_keys)
+    elif isinstance(obj, list):
+        hash_value.update(b'list')
+        for item in obj:
+            _hash_pdf_object(item, hash_value, seen, skip_keys)
+    elif not hasattr(obj, 'get_data'):
+        hash_value.update(repr(obj).encode('utf-8'))
+
+
+def pdf_page_fingerprints(pdf_file, page_nums, verbose=print):
+    """
+    Get fingerprints of the contents of the PDF pages without rendering them.
+    A fingerprint covers the page geometry, the content stream, the
+    resources (fonts, images and so on) used in it, the annotations
+    (such as links and form fields) and the transparency group, but not the
+    document-level data that changes whenever the PDF is exported again.
+    Requires the pypdf package; returns None if it is not available or
+    the file cannot be read with it.
+    """
+    try:
+        from pypdf import PdfReader
+        from pypdf.errors import PyPdfError
+    except ImportError:
+        verbose('The pypdf package is not available, identifying the PDF ' \
+                'pages by the file contents')
+        return None
+    try:
+        reader = PdfReader(pdf_file)
+        fingerprints = {}
+        for page_num in set(page_nums):
+            page = reader.pages[page_num-1]
+            hash_value = hashlib.sha256()
+            for key in ('/MediaBox', '/CropBox', '/Rotate', '/UserUnit',
+                        '/Contents', '/Resources', '/Group', '/Annots'):
+                hash_value.update(key.encode('utf-8'))
+                if key == '/Annots' and key in page:
+                    # The annotations refer back to the page with /P and
+                    # the link destinations and actions to other pages
+                    _hash_pdf_object(page[key], hash_value, set(),
+                                     ('/Parent', '/Length', '/P', '/Dest', '/A'))
+                elif key in page:
+                    _hash_pdf_object(page[key], hash_value, set())
+            fingerprints[page_num] = hash_value.hexdigest()
+        return fingerprints
+    except (PyPdfError, OSError) as err:
+        verbose(f'Could not read the PDF pages with pypdf ({err}), ' \
+                f'identifying them by the file contents')
+        return None
+
+
+def page_image_hashes(pdf_file, page_nums, resolution, verbose=print):
+    """
+    Get the hashes for caching the rendered images of the PDF pages.
+    The pages are identified by their content fingerprints if available,
+    so that the unchanged pages of a re-exported PDF keep their hashes,
+    and otherwise by the PDF file contents and the page number.
+    """
+    fingerprints = pdf_page_fingerprints(pdf_file, page_nums, verbose)
+    pdf_hash = None
+    if fingerprints is None:
+        pdf_hash = file_hash(pdf_file).hexdigest()
+    hashes = {}
+    for page_num in set(page_nums):
+        hash_value = hashlib.sha256()
+        hash_value.update(f'resolution {resolution}'.encode('utf-8'))
+        if fingerprints is not None:
+            hash_value.update(b'page '+fingerprints[page_num].encode('utf-8'))
+        else:
+            hash_value.update(f'pdf {pdf_hash} page {page_num}'.encode('utf-8'))
+        hashes[page_num] = hash_value.hexdigest()
+    return hashes
+
+
+def render_pages(args, pages, only, hashes, resolution, cache, scheduler,
+                 pools, execute, verbose, profiler):
+    """
+    Convert the selected PDF pages to images (cache the results).
+    The image hashes of the selected page numbers are given in hashes.
+    Each distinct uncached PDF page is rendered only once, contiguous page
+    ranges are rendered with a single pdftoppm run, and the runs are
+    added to the scheduler as tasks executed in parallel in the render pool.
+    The page images being rendered by a concurrent build sharing the pools
+    are waited for instead of rendered again.
+    Returns the list of image files, one for each entry in pages (None for
+    the entries not in only), and a dictionary mapping the page numbers
+    being rendered to their rendering tasks.
+    """
+    page_nums = [page_num for (index, page_num) in enumerate(pages)
+                 if index in only]
+    images = {page_num: os.path.join('pages', hashes[page_num]+'.png')
+              for page_num in hashes}
+    # The tasks of the pages rendered by this build, completed when
+    # the batches containing the pages have been rendered
+    missing = {}
+    def start_page(page_num):
+        task = Future()
+        if cache.lookup(images[page_num]):
+            task.set_result(None)
+        else:
+            missing[page_num] = task
+        return task
+    tasks = {}
+    for page_num in images:
+        with profiler.span('page cache lookup', page=page_num) as span:
+            task = pools.shared_task(
+                ('image', os.path.abspath(cache.path(images[page_num]))),
+                lambda: start_page(page_num))
+            if page_num in missing:
+                span['cache'] = 'miss'
+            elif task.done():
+                span['cache'] = 'hit'
+            else:
+                span['cache'] = 'shared'
+        if not task.done():
+            tasks[page_num] = task
+    if len(page_nums) > 0 and len(tasks) == 0:
+        verbose('All the PDF pages found in cache')
+    batches = page_batches(sorted(missing), cpu_count())
+    def render(batch):
+        (first, last) = batch
+        if first == last:
+            verbose(f'Extracting and converting PDF page {first}')
+        else:
+            verbose(f'Extracting and converting PDF pages {first}-{last}')
+        root = f'{args.temp_prefix}-p{first}'
+        cmd = f'{args.pdftoppm} -png -scale-to-y {resolution} ' \
+              f'-scale-to-x -1 -f {first} -l {last} {args.pdf_file} {root}'
+        # pdftoppm pads the page numbers in the file names with zeros
+        # depending on the number of pages in the document
+        root_dir = os.path.dirname(root)
+        name_re = re.compile('^'+re.escape(os.path.basename(root))+r'-(\d+)\.png$')
+        with profiler.span('render pages', pages=f'{first}-{last}') as span:
+            execute(cmd)
+            rendered = {}
+            for file_name in os.listdir(root_dir if root_dir != '' else '.'):
+                match = name_re.match(file_name)
+                if match and int(match.group(1)) in images:
+                    rendered[int(match.group(1))] = os.path.join(root_dir,
+                                                                 file_name)
+            span['bytes_out'] = sum(os.path.getsize(file_name)
+                                    for file_name in rendered.values())
+        for (page_num, file_name) in rendered.items():
+            shutil.move(file_name, cache.path(images[page_num]))
+            cache.add(images[page_num], f'{args.pdf_file} page {page_num}')
+    def copy_result(batch_task, first, last):
+        for page_num in range(first, last+1):
+            if batch_task.exception() is not None:
+                missing[page_num].set_exception(batch_task.exception())
+            else:
+                missing[page_num].set_result(None)
+    for (first, last) in batches:
+        task = scheduler.add(pools.render, render, ((first, last),))
+        task.add_done_callback(lambda task, first=first, last=last:
+                               copy_result(task, first, last))
+    return ([cache.path(images[page_num]) if index in only else None
+             for (index, page_num) in enumerate(pages)],
+            tasks)
+
+
+def segment_hash(image_hash, audio_hash, srt_file, encoder_settings):
+    """
+    Get the hash for caching an encoded page segment.
+    It covers everything the segment is made of: the page image and
+    the audio (identified by their cache hashes), the subtitles (None if
+    the subtitles are not included), and the encoder settings.
+    """
+    hash_value = hashlib.sha256()
+    hash_value.update(encoder_settings.encode('utf-8'))
+    hash_value.update(image_hash.encode('utf-8'))
+    hash_value.update(audio_hash.encode('utf-8'))
+    hash_value.update(b'subtitles:' if srt_file is not None else b'none')
+    if srt_file is not None:
+        file_hash(srt_file, hash_value)
+    return hash_value.hexdigest()
+
+
+def concat_list_entry(file_name):
+    """A line for the ffmpeg concat demuxer input file."""
+    quoted = os.path.abspath(file_name).replace("'", "'\\''")
+    return f"file '{quoted}'\n"
+
+
+def parse_script(script, neural):
+    """
+    Parse the lines of a #page script once.
+    Returns the list of (SSML, words, sub-titles) triples of the lines,
+    shared by the SSML production, the audio hashing, and the sub-titles.
+    Raises BuildError if a line is malformed.
+    """
+    try:
+        return [parse(line, neural, linenum) for (line, linenum) in script]
+    except ParseError as err:
+        raise BuildError(str(err)) from err
+
+
+def script_to_ssml_and_hash(script, args, parsed=None):
     """
     Transform a script to SSML.
+    A script longer than args.tts_max_chars characters is split at
+    line boundaries into several SSML documents, so that the parts fit in
+    a TTS request and can be synthesized concurrently.
     Also returns a hash of the voice, style, and the script
     for caching audio files produced by the TTS system.
+    The already parsed lines of the script can be given in parsed.
     """
+    if parsed is None:
+        parsed = parse_script(script, args.neural)
+
+    def document(lines_ssml, first):
+        ssml = ''
+        ssml += '<speak>'
+        if first:
+            ssml += '<break time="200ms" />'
+        if args.conversational:
+            ssml += '<amazon:domain name="conversational">'
+        ssml += '\n'
+        ssml += ''.join(lines_ssml)
+        if args.conversational:
+            ssml += '</amazon:domain>'
+        ssml += '</speak>'
+        ssml += '\n'
+        return ssml
 
     hash_value = hashlib.sha256()
+    if args.tts != 'polly':
+        # Keep the audio of the other backends apart in the cache
+        hash_value.update(f'tts {args.tts} '.encode('utf-8'))
     hash_value.update(args.voice.encode('utf-8'))
     hash_value.update(str(args.neural).encode('utf-8'))
     hash_value.update(str(args.conversational).encode('utf-8'))
-    ssml = ''
-    ssml += '<speak><break time="200ms" />'
-    if args.conversational:
-        ssml += '<amazon:domain name="conversational">'
-    ssml += '\n'
-    for (page_linenum, (line,linenum)) in enumerate(script):
-        ast = parse_to_ast(line, linenum)
+    overhead = len(document([], True))
+    chunks = [[]]
+    chunk_starts = [0]
+    size = overhead
+    for (page_linenum, (line_ssml, _, _)) in enumerate(parsed):
         l_ssml = ''
         # Start-of-the-line marks for subtitle synchronization
         l_ssml += f'<mark name="s{page_linenum}"/>'
         # Line contents in SSML
-        l_ssml += ''.join([node.to_ssml(args.neural) for node in ast])+'\n'
+        l_ssml += line_ssml+'\n'
         # End-of-the-line marks for subtitle synchronization
         l_ssml += f'<mark name="e{page_linenum}"/>'
-        ssml += l_ssml
+        if args.tts_max_chars > 0 and len(chunks[-1]) > 0 and \
+           size + len(l_ssml) > args.tts_max_chars:
+            chunks.append([])
+            chunk_starts.append(page_linenum)
+            size = overhead
+        chunks[-1].append(l_ssml)
+        size += len(l_ssml)
         hash_value.update(l_ssml.encode('utf-8'))
-    if args.conversational:
-        ssml += '</amazon:domain>'
-    ssml += '</speak>'
-    ssml += '\n'
-    return (ssml, hash_value.hexdigest())
+    if len(chunks) > 1:
+        # The audio of a split script depends on where it is split
+        hash_value.update(('chunks '+' '.join(str(start) for start in
+                                              chunk_starts)).encode('utf-8'))
+    return ([document(lines, number == 0)
+             for (number, lines) in enumerate(chunks)],
+            hash_value.hexdigest())
 
 
-def main():
-    """The main routine."""
+def cache_main(argv):
+    """The main routine of the "pdf2video cache" command."""
+    argp = argparse.ArgumentParser(
+        prog='pdf2video cache',
+        formatter_class = argparse.ArgumentDefaultsHelpFormatter,
+        description = 'Show statistics of or clean the pdf2video cache.')
+    argp.add_argument('command', choices=['stats', 'gc'],
+                   help='show the cache statistics, or evict files from ' \
+                   'the cache')
+    argp.add_argument('--audio_cache', metavar='C', default='pdf2video-cache',
+                   help='the cache directory')
+    argp.add_argument('--max_size', metavar='S', type=parse_size, default=None,
+                   help='evict the least recently used files until the ' \
+                   'cache is at most this large (for instance 500M or 10G)')
+    argp.add_argument('--max_age', metavar='A', type=parse_age, default=None,
+                   help='evict the files not used within this time ' \
+                   '(for instance 12h or 30d)')
+    args = argp.parse_args(argv)
+    if not os.path.isdir(args.audio_cache):
+        argp.exit(1, f'Not a directory: {args.audio_cache}\n')
+    cache = CacheIndex(args.audio_cache)
+    if args.command == 'gc':
+        missing = cache.verify()
+        if len(missing) > 0:
+            print(f'Dropped {len(missing)} missing files from the index')
+        before = cache.total_size()
+        evicted = cache.gc(args.max_size, args.max_age)
+        cache.save()
+        print(f'Evicted {len(evicted)} files, ' \
+              f'freed {format_size(before - cache.total_size())}')
+    stats = cache.stats()
+    for kind in sorted(stats):
+        (count, size) = stats[kind]
+        print(f'{kind:<20} {count:>8} files {format_size(size):>10}')
+    print(f'{"total":<20} {sum(count for (count, _) in stats.values()):>8} ' \
+          f'files {format_size(cache.total_size()):>10}')
+
+
+def make_arg_parser():
+    """Make the command line argument parser of a build."""
     description = 'A tool for converting PDF presentations into ' \
                   'narrated videos. Please see ' \
                   'https://github.com/tjunttila/pdf2video/ for more details.'
     argp = argparse.ArgumentParser(
         formatter_class = argparse.ArgumentDefaultsHelpFormatter,
         description = description)
-    argp.add_argument('--voice', metavar='V', default='Joanna',
-                   help='the applied TTS voice')
+    argp.add_argument('--tts', choices=sorted(default_voices),
+                   default='polly', help='the TTS backend: Amazon Polly, ' \
+                   'or the offline espeak-ng synthesizer for fast local ' \
+                   'draft builds (run on all the CPUs)')
+    argp.add_argument('--voice', metavar='V', default=None,
+                   help='the applied TTS voice (default: ' +
+                   ', '.join(f'{voice} with {tts}' for (tts, voice)
+                             in sorted(default_voices.items())) + ')')
     argp.add_argument('--neural', action='store_true',
                    help='use neural TTS')
     argp.add_argument('--conversational', action='store_true',
                    help='use conversational style')
     argp.add_argument('--aws_profile', metavar='A', default='default',
                    help='a Polly-enabled AWS profile')
+    argp.add_argument('--tts_client', choices=['auto', 'boto3', 'cli'],
+                   default='auto', help='how to call Polly: in-process with ' \
+                   'boto3 or with the AWS command line tool ' \
+                   '(auto: boto3 if installed)')
+    argp.add_argument('--polly_endpoint', metavar='URL', default=None,
+                   help='override the Polly endpoint URL')
+    argp.add_argument('--tts_jobs', metavar='N', type=int, default=4,
+                   help='the maximum number of concurrent TTS requests')
+    argp.add_argument('--tts_rate', metavar='R', type=float, default=8,
+                   help='the maximum number of TTS requests started per ' \
+                   'second (0 for no limit)')
+    argp.add_argument('--tts_retries', metavar='N', type=int, default=5,
+                   help='the number of retries of a throttled TTS request')
+    argp.add_argument('--tts_max_chars', metavar='N', type=int, default=3000,
+                   help='split the SSML of longer #pages at line boundaries ' \
+                   'into TTS requests of at most this many characters, ' \
+                   'synthesized concurrently (0: do not split)')
     argp.add_argument('--audio_cache', metavar='C', default='pdf2video-cache',
-                   help='the directory for caching TTS audio files')
+                   help='the directory for caching TTS audio files, ' \
+                   'rendered PDF pages, and encoded page segments')
+    argp.add_argument('--cache_max_size', metavar='S', type=parse_size,
+                   default=None, help='after the build, evict the least ' \
+                   'recently used cache files until the cache is at most ' \
+                   'this large (for instance 500M or 10G)')
+    argp.add_argument('--cache_max_age', metavar='A', type=parse_age,
+                   default=None, help='after the build, evict the cache ' \
+                   'files not used within this time (for instance 12h or 30d)')
     argp.add_argument('--temp_prefix', metavar='T', default='pdf2video-temp',
                    help='the prefix for the created temporary files')
     argp.add_argument('--ignore_subtitles', action='store_true',
                    help='do not include or produce subtitles')
+    argp.add_argument('--stream_pages', action='store_true',
+                   help='pipe the rendered PDF pages directly to the encoder ' \
+                   'instead of caching them as image files')
+    argp.add_argument('--encoding', choices=['standard', 'still'],
+                   default='standard', help='how the pages are encoded: ' \
+                   'standard uses the default frame rate, still encodes ' \
+                   'the pages as one frame per second, which is much ' \
+                   'faster and makes smaller files')
+    argp.add_argument('--assembly', choices=['segments', 'single'],
+                   default='segments', help='how the video is assembled: ' \
+                   'segments encodes each page separately (caching the ' \
+                   'segments) and concatenates them, single encodes the ' \
+                   'whole video with one FFmpeg process (nothing cached, ' \
+                   'but no per-page process overhead)')
+    argp.add_argument('--preview', action='store_true',
+                   help='make a quick draft of the video: render the pages ' \
+                   'at the preview resolution instead of 1080 lines, ' \
+                   'use the fastest encoder preset and a lower audio ' \
+                   'bitrate, and cache the segments separately')
+    argp.add_argument('--preview_resolution', metavar='H', type=int,
+                   choices=[480, 720], default=720,
+                   help='the height of the preview video')
+    argp.add_argument('--jobs', metavar='N', type=int, default=0,
+                   help='the number of pages encoded concurrently; the CPUs ' \
+                   'are split evenly between them (0: one per CPU)')
+    argp.add_argument('--subtitle_formats', metavar='F', default='vtt',
+                   help='a comma-separated list of the formats of the ' \
+                   'separate subtitle files produced next to the video: ' \
+                   f'{", ".join(sorted(WRITERS))}')
+    argp.add_argument('--watch', action='store_true',
+                   help='keep running and rebuild the video whenever the PDF ' \
+                   'or the script file changes, redoing only the changed pages')
+    argp.add_argument('--profile', metavar='F', default=None,
+                   help='write the timings of the build stages and ' \
+                   'subprocesses to the file in the Chrome trace event ' \
+                   'format, and print a summary table at the end')
     argp.add_argument('--quiet', action='store_true',
                    help='do not print progress information')
     argp.add_argument('--pages', metavar='P', default='all', help=
@@ -295,22 +712,179 @@ def main():
     #               help="the output file")
     argp.add_argument('--ffmpeg', default='ffmpeg',
                    help='the FFmpeg command line tool executable')
+    argp.add_argument('--espeak', default='espeak-ng',
+                   help='the espeak-ng executable')
+    argp.add_argument('--ffprobe', default='ffprobe',
+                   help='the FFprobe command line tool executable')
     argp.add_argument('--pdfinfo', default='pdfinfo',
                    help='the "pdfinfo" executable from Poppler utils')
     argp.add_argument('--pdftoppm', default='pdftoppm',
                    help='the "pdftoppm" executable from Poppler utils')
     argp.add_argument('pdf_file', help="the input PDF file")
     argp.add_argument('script_file', help="the input script file")
-    argp.add_argument('output_file', help="the output mp4 video file")
+    argp.add_argument('output_file', help="the output mp4 video file, or " \
+                   "an m3u8 playlist for HTTP Live Streaming (HLS), updated " \
+                   "as soon as each page is encoded")
     #argp.add_argument('files', nargs=argparse.REMAINDER)
-    args = argp.parse_args()
+    return argp
+
+
+class BuildError(Exception):
+    """An error that makes a build fail."""
+
+
+# The numbers of the builds in this process, naming their temporary files
+build_numbers = itertools.count(1)
+
+
+class BuildPools:
+    """
+    The worker pools of builds: one for rendering PDF pages, one for the
+    TTS requests (with a shared request rate limit), one for encoding
+    the page segments, and one for the other file work between them,
+    such as joining audio parts, writing subtitles and publishing
+    HLS streams. The pools can be shared by concurrent builds,
+    as can the TTS clients they make.
+    If encoder_threads is None, each build splits the CPUs between
+    the encoders of its segments.
+    """
+    def __init__(self, render_workers, tts_workers, tts_rate, encoders,
+                 encoder_threads=None, io_workers=4):
+        self.render = ThreadPoolExecutor(max_workers=max(1, render_workers))
+        self.io = ThreadPoolExecutor(max_workers=max(1, io_workers))
+        self.tts = ThreadPoolExecutor(max_workers=max(1, tts_workers))
+        self.tts_bucket = TokenBucket(tts_rate, tts_workers)
+        self.tts_workers = max(1, tts_workers)
+        self.encode = ThreadPoolExecutor(max_workers=max(1, encoders))
+        self.encoders = max(1, encoders)
+        self.encoder_threads = encoder_threads
+        self.clients = {}
+        self.lock = threading.Lock()
+        # The unfinished tasks shared by the builds, and the locks of
+        # the files the builds make
+        self.tasks = {}
+        self.file_locks = {}
+        self.tasks_lock = threading.Lock()
+
+    def tts_client(self, args):
+        """
+        Get the TTS client of the backend and the voice in the build
+        arguments, made once and then reused.
+        """
+        if args.tts == 'espeak-ng':
+            key = (args.tts, args.voice, args.espeak, args.ffmpeg)
+        else:
+            key = (args.tts_client, args.voice, args.neural, args.aws_profile,
+                   args.polly_endpoint)
+        with self.lock:
+            if key not in self.clients:
+                if args.tts == 'espeak-ng':
+                    self.clients[key] = EspeakNG(args.voice, args.espeak,
+                                                 args.ffmpeg)
+                else:
+                    self.clients[key] = make_polly_client(*key,
+                                                          self.tts_workers)
+            return self.clients[key]
 
-    def verbose(msg):
-        if not args.quiet:
-            print(msg)
+    def shared_task(self, key, make):
+        """
+        Get the unfinished task of the key made by any build sharing
+        the pools, or make one with make() if there is none, so that
+        concurrent builds wait on the same work instead of repeating it.
+        """
+        with self.tasks_lock:
+            task = self.tasks.get(key)
+            if task is not None:
+                return task
+            # A placeholder for the task, which is made without the lock
+            task = Future()
+            self.tasks[key] = task
+        def forget(_):
+            with self.tasks_lock:
+                if self.tasks.get(key) is task:
+                    del self.tasks[key]
+        task.add_done_callback(forget)
+        def copy_result(made):
+            if made.exception() is not None:
+                task.set_exception(made.exception())
+            else:
+                task.set_result(made.result())
+        try:
+            made = make()
+        except BaseException as err:
+            task.set_exception(err)
+            raise
+        made.add_done_callback(copy_result)
+        return task
+
+    def file_lock(self, file_name):
+        """The lock held by the builds while making the file."""
+        with self.tasks_lock:
+            return self.file_locks.setdefault(os.path.abspath(file_name),
+                                              threading.Lock())
+
+    def shutdown(self):
+        """Wait for the pools to finish their work and release them."""
+        for executor in [self.render, self.tts, self.encode, self.io]:
+            executor.shutdown()
+
+
+class BuildMemo:
+    """
+    The in-memory results of the builds of a video, such as the parsed
+    scripts and the page and audio hashes, reused by the next builds
+    in the watch mode. Only the results used in the latest build are kept.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.previous = {}
+        self.current = {}
+        # The (audio hash, image hash) pairs of the pages in the latest build
+        self.pages = None
+
+    def new_build(self):
+        """Start a new build, forgetting the results not used in the latest."""
+        with self.lock:
+            self.previous = self.current
+            self.current = {}
+
+    def get(self, key, compute):
+        """Get the result for the key, computing it if not known."""
+        with self.lock:
+            if key in self.current:
+                return self.current[key]
+            if key in self.previous:
+                self.current[key] = self.previous[key]
+                return self.current[key]
+        value = compute()
+        with self.lock:
+            self.current[key] = value
+        return value
 
-    temp_image_files = []
-    temp_ssml_files = []
+
+def build(args, pools=None, cache=None, profiler=None, verbose=None,
+          memo=None):
+    """
+    Build the video described by the parsed command line arguments.
+    The worker pools and the cache index can be shared with other builds;
+    by default, the build makes its own. A memo of the previous build
+    of the same video can be given to reuse its in-memory results.
+    Raises BuildError if the build fails.
+    """
+    if verbose is None:
+        def verbose(msg):
+            if not args.quiet:
+                print(msg)
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    own_pools = pools is None
+    own_cache = cache is None
+    if memo is None:
+        memo = BuildMemo()
+
+    # The temporary files of the build are named by the build,
+    # as concurrent builds may make the same files
+    build_id = f'{os.getpid()}-{next(build_numbers)}'
     temp_ts_files = []
     def unlink(file_name):
         if file_name is None:
@@ -321,21 +895,20 @@ def main():
             pass
     def clean_temps():
         # remove the created temporary files
-        for file_name in temp_image_files:
-            unlink(file_name)
-        for file_name in temp_ssml_files:
-            unlink(file_name)
         for file_name in temp_ts_files:
             unlink(file_name)
 
     def error(msg):
-        clean_temps()
-        argp.exit(1, msg+'\n')
+        raise BuildError(msg)
 
     def execute(cmd):
+        tool = os.path.basename(cmd.split()[0])
         try:
-            exec_result = subprocess.run(re.split(r'\s+', cmd.strip()),
-                                         stdout=PIPE, stderr=PIPE, check=False)
+            with profiler.span(tool, 'subprocess', cmd=cmd) as span:
+                exec_result = subprocess.run(re.split(r'\s+', cmd.strip()),
+                                             stdout=PIPE, stderr=PIPE,
+                                             check=False)
+                span['bytes_out'] = len(exec_result.stdout)
         except Exception as err:
             error(f'Error when executing "{cmd}".\n'+str(err))
         if exec_result.returncode != 0:
@@ -345,196 +918,819 @@ def main():
                   '\n'.join((exec_result.stderr.decode('utf-8').split('\n'))[-11:]))
         return exec_result
 
+    def execute_pipe(producer_cmd, consumer_cmd):
+        # Execute the commands with the standard output of the producer
+        # piped to the standard input of the consumer
+        try:
+            producer = subprocess.Popen(re.split(r'\s+', producer_cmd.strip()),
+                                        stdout=PIPE, stderr=PIPE)
+            consumer = subprocess.Popen(re.split(r'\s+', consumer_cmd.strip()),
+                                        stdin=producer.stdout,
+                                        stdout=PIPE, stderr=PIPE)
+        except Exception as err:
+            error(f'Error when executing "{producer_cmd} | {consumer_cmd}".\n'+
+                  str(err))
+        # Only the consumer may read the pipe
+        producer.stdout.close()
+        tools = ' | '.join(os.path.basename(cmd.split()[0])
+                           for cmd in [producer_cmd, consumer_cmd])
+        with profiler.span(tools, 'subprocess',
+                           cmd=f'{producer_cmd} | {consumer_cmd}'):
+            (_, consumer_stderr) = consumer.communicate()
+            producer_stderr = producer.stderr.read()
+            producer.wait()
+        for (cmd, process, stderr) in [(producer_cmd, producer, producer_stderr),
+                                       (consumer_cmd, consumer, consumer_stderr)]:
+            if process.returncode != 0:
+                error(f'Error when executing "{cmd}". The last 10 lines of ' \
+                      f'the stderr output is as follows:\n' +
+                      '\n'.join((stderr.decode('utf-8').split('\n'))[-11:]))
+
     def make_dir(dir_name):
         if os.path.exists(dir_name):
             if not os.path.isdir(dir_name):
                 error("Not a directory: "+dir_name)
-        else: os.mkdir(dir_name)
+        else: os.makedirs(dir_name, exist_ok=True)
 
+    # The tasks of the pages are run in the worker pools as soon as
+    # their inputs are ready, so that the first pages are encoded while
+    # the later ones are still being rendered and synthesized
+    scheduler = Scheduler()
+    try:
+        if not args.output_file.endswith((".mp4", ".m3u8")):
+            error("The output file name must end with .mp4 or .m3u8")
+        hls = args.output_file.endswith(".m3u8")
+        output_root = os.path.splitext(args.output_file)[0]
 
-    if not args.output_file.endswith(".mp4"):
-        error("The output file name must end with .mp4")
+        subtitle_formats = []
+        for subtitle_format in args.subtitle_formats.split(','):
+            subtitle_format = subtitle_format.strip().lower()
+            if subtitle_format == '':
+                continue
+            if subtitle_format not in WRITERS:
+                error(f'Unsupported subtitle format {subtitle_format}. ' \
+                      f'The available formats are {", ".join(sorted(WRITERS))}.')
+            subtitle_formats.append(subtitle_format)
 
-    pages = parse_page_range(args, execute, error)
+        if args.assembly == 'single' and args.stream_pages:
+            error('The pages cannot be streamed with the single assembly')
+        if args.assembly == 'single' and hls:
+            error('HLS output needs the segments assembly')
 
-    # Check voice arguments consistency
-    if args.voice not in voices:
-        error(f'Unsupported voice {args.voice}. The available voices are {", ".join(voices)}.')
-    if args.neural and args.voice not in voices_neural:
-        error(f'The voice {args.voice} is not available in neural TTS. ' \
-              f'The available neural voices are {", ".join(voices_neural)}.')
-    if args.conversational:
-        args.neural = True
-        if args.voice not in voices_conversational:
-            error(f'The voice {args.voice} is not available in ' \
-                  f'conversational style. The available conversational ' \
-                  f'voices are {", ".join(voices_conversational)}.')
+        with profiler.span('page range'):
+            pages = parse_page_range(args, execute, error)
 
-    (scripts, scripts_names) = read_scripts(args.script_file, error)
+        # Check voice arguments consistency
+        if args.voice is None:
+            args.voice = default_voices[args.tts]
+        if args.tts != 'polly':
+            # The voices of the other backends are checked by the backend
+            if args.neural or args.conversational:
+                error('Neural TTS and conversational style are only ' \
+                      'available with Polly')
+        elif args.voice not in voices:
+            error(f'Unsupported voice {args.voice}. The available voices are {", ".join(voices)}.')
+        elif args.neural and args.voice not in voices_neural:
+            error(f'The voice {args.voice} is not available in neural TTS. ' \
+                  f'The available neural voices are {", ".join(voices_neural)}.')
+        if args.tts == 'polly' and args.conversational:
+            args.neural = True
+            if args.voice not in voices_conversational:
+                error(f'The voice {args.voice} is not available in ' \
+                      f'conversational style. The available conversational ' \
+                      f'voices are {", ".join(voices_conversational)}.')
 
-    make_dir(args.audio_cache)
+        with profiler.span('read scripts'):
+            (scripts, scripts_names) = read_scripts(args.script_file, error)
 
-    if len(scripts) != len(pages):
-        error(f'{len(pages)} PDF pages selected but the script file ' \
-              f'contains {len(scripts)} scripts')
+        make_dir(args.audio_cache)
+        make_dir(os.path.join(args.audio_cache, 'pages'))
+        # The preview segments are kept apart, so that they can be
+        # cleaned up without affecting the segments of the final videos
+        segments_dir = 'segments-preview' if args.preview else 'segments'
+        make_dir(os.path.join(args.audio_cache, segments_dir))
+        if own_cache:
+            cache = CacheIndex(args.audio_cache)
+        build_start = time.time()
+        # The height of the rendered pages and the video
+        resolution = args.preview_resolution if args.preview else 1080
 
-    only = parse_only(args, scripts, scripts_names, error)
+        if len(scripts) != len(pages):
+            error(f'{len(pages)} PDF pages selected but the script file ' \
+                  f'contains {len(scripts)} scripts')
 
-    # Select and convert selected pages to images
-    for (index, page_num) in enumerate(pages):
-        if index not in only:
-            temp_image_files.append(None)
-            continue
-        verbose(f'Extracting and converting PDF page {page_num}')
-        image_file = f'{args.temp_prefix}-{index+1}'
-        temp_image_files.append(image_file+".ppm")
-        cmd = f'{args.pdftoppm} -scale-to-y 1080 -scale-to-x -1 ' \
-              f'-f {page_num} -singlefile {args.pdf_file} {image_file}'
-        execute(cmd)
-
-    # Make audio files with AWS Polly (cache the results)
-    audio_files = []
-    marks_files = []
-    profile_arg = '' if args.aws_profile == 'default' else f'--profile {args.aws_profile}'
-    for (index, script) in enumerate(scripts):
-        if index not in only:
-            temp_ssml_files.append(None)
-            audio_files.append(None)
-            marks_files.append(None)
-            continue
-        #
-        # Audio track
-        #
-        verbose('Making the audio track %d' % (index+1))
-        (ssml, hash_hex) = script_to_ssml_and_hash(script, args)
-        ssml_file = f'{args.temp_prefix}-{index+1}.ssml'
-        temp_ssml_files.append(ssml_file)
-        with open(ssml_file, "w", encoding='utf-8') as file_handle:
-            file_handle.write(ssml)
-        audio_file = os.path.join(args.audio_cache, hash_hex+".mp3")
-        marks_file = os.path.join(args.audio_cache, hash_hex+".mrk")
-        # Use Polly to generate the MP3 file if not in cache
-        if os.path.isfile(audio_file):
-            verbose('  Audio file found in cache')
+        only = parse_only(args, scripts, scripts_names, error)
+        encode_indices = [index for index in range(len(pages)) if index in only]
+        if own_pools:
+            pools = BuildPools(cpu_count(), tts_workers(args), args.tts_rate,
+                               encoder_plan(args.jobs, len(encode_indices))[0])
+
+        # Parse each selected script line once, for both the audio and subtitles
+        memo.new_build()
+        with profiler.span('parse scripts'):
+            parsed_scripts = [memo.get(('parse', tuple(line for (line, _) in script),
+                                        args.neural),
+                                       lambda: parse_script(script, args.neural))
+                              if index in only else None
+                              for (index, script) in enumerate(scripts)]
+
+        # The hashes of the page images, recomputed only if the PDF changes
+        with profiler.span('page hashes'):
+            try:
+                stat = os.stat(args.pdf_file)
+            except OSError:
+                error(f'Could not read the PDF file "{args.pdf_file}"')
+            page_nums = frozenset(pages[index] for index in only)
+            hashes = memo.get(('pages', os.path.abspath(args.pdf_file),
+                               stat.st_mtime_ns, stat.st_size, resolution,
+                               page_nums),
+                              lambda: page_image_hashes(args.pdf_file, page_nums,
+                                                        resolution, verbose))
+
+        # Select and convert selected pages to images (cache the results)
+        image_hashes = [hashes[page_num] if index in only else None
+                        for (index, page_num) in enumerate(pages)]
+        if args.stream_pages:
+            # The pages are rendered and piped to the encoder only when needed
+            image_files = [None] * len(pages)
+            image_tasks = {}
         else:
-            verbose('  Calling Polly for the audio file')
-            cmd = f'aws {profile_arg} polly synthesize-speech ' \
-                  f'--text-type ssml --text file://{ssml_file} ' \
-                  f'--output-format mp3 --voice-id {args.voice}'
-            if args.neural:
-                cmd += ' --engine neural'
-            cmd += f' {audio_file}'
-            execute(cmd)
-        audio_files.append(audio_file)
-        #
-        # Speech marks for subtitles
-        #
-        if not args.ignore_subtitles:
-            # Use Polly to generate the speech marks JSON file if not in cache
-            if os.path.isfile(marks_file):
-                verbose('  Speech marks found in cache')
-            else:
-                verbose('  Calling Polly for speech marks')
-                cmd = f'aws {profile_arg} polly synthesize-speech ' \
-                      f'--text-type ssml --text file://{ssml_file} ' \
-                      f'--output-format json ' \
-                      f'--speech-mark-types sentence word viseme ssml ' \
-                      f'--voice-id {args.voice}'
-                if args.neural:
-                    cmd += ' --engine neural'
-                cmd += f' {marks_file}'
-                execute(cmd)
-            marks_files.append(marks_file)
+            with profiler.span('render'):
+                (image_files, image_tasks) = render_pages(args, pages, only,
+                                                          hashes, resolution,
+                                                          cache, scheduler,
+                                                          pools,
+                                                          execute, verbose,
+                                                          profiler)
 
-    if not args.ignore_subtitles:
-        #
-        # Make srt subtitles
-        #
+        # Make audio files with the TTS backend (cache the results)
+        tts_name = 'Polly' if args.tts == 'polly' else args.tts
+        def tts(request):
+            try:
+                client = pools.tts_client(args)
+                synthesize(client, request,
+                           pools.tts_bucket if getattr(client, 'rate_limited',
+                                                       True) else None,
+                           args.tts_retries, verbose=verbose, profiler=profiler)
+            except TTSError as err:
+                error(str(err))
+        def save_timings(hash_hex, timings, origin):
+            # Written under a temporary name first, so that a killed build
+            # leaves no truncated line timings in the cache
+            part_file = cache.path(f'{hash_hex}.{build_id}.part.tim')
+            temp_ts_files.append(part_file)
+            write_timings(timings, part_file)
+            os.replace(part_file, cache.path(hash_hex+'.tim'))
+            cache.add(hash_hex+'.tim', origin)
+        def finish_audio(hash_hex, origin, nof_parts, audio_fetched, marks):
+            # Add the synthesized audio and line timings to the cache;
+            # marks tells whether the line timings are in the cache ('hit'),
+            # must be converted from cached ('marks') or fetched ('miss')
+            # speech marks, or are not needed (None)
+            if nof_parts > 1:
+                # Concatenate the audio parts, and shift the line timings of
+                # each part by the total duration of the preceding parts
+                part_files = [cache.path(f'{hash_hex}.{number}.{build_id}.part')
+                              for number in range(nof_parts)]
+                with profiler.span('join audio parts', parts=nof_parts):
+                    audio_part = cache.path(f'{hash_hex}.{build_id}.part.mp3')
+                    temp_ts_files.append(audio_part)
+                    durations = concatenate_mp3([part_file+'.mp3'
+                                                 for part_file in part_files],
+                                                audio_part)
+                    os.replace(audio_part, cache.path(hash_hex+'.mp3'))
+                    cache.add(hash_hex+'.mp3', origin)
+                    if marks is not None:
+                        offsets = [round(1000 * sum(durations[:number]))
+                                   for number in range(nof_parts)]
+                        save_timings(hash_hex,
+                                     join_timings([read_speech_marks(part_file+'.mrk')
+                                                   for part_file in part_files],
+                                                  offsets),
+                                     origin)
+                for part_file in part_files:
+                    unlink(part_file+'.mp3')
+                    unlink(part_file+'.mrk')
+                return
+            if audio_fetched:
+                cache.add(hash_hex+'.mp3', origin)
+            if marks in ('marks', 'miss'):
+                if marks == 'marks':
+                    marks_file = cache.path(hash_hex+'.mrk')
+                else:
+                    marks_file = cache.path(f'{hash_hex}.{build_id}.part.mrk')
+                with profiler.span('parse marks',
+                                   bytes_in=os.path.getsize(marks_file)):
+                    save_timings(hash_hex, read_speech_marks(marks_file),
+                                 origin)
+                if marks == 'miss':
+                    # Only the line timings are kept in the cache
+                    unlink(marks_file)
+        def start_audio(index, hash_hex, ssml_parts, origin):
+            # Start the task making the audio file and the line timings
+            tts_requests = []
+            if len(ssml_parts) > 1:
+                # The audio and the speech marks of the parts are needed
+                # together for shifting the marks by the part durations
+                with profiler.span('audio cache lookup', page=index+1) as span:
+                    span['cache'] = 'hit' if cache.lookup(hash_hex+".mp3") and \
+                        (args.ignore_subtitles or cache.lookup(hash_hex+".tim")) \
+                        else 'miss'
+                if span['cache'] == 'hit':
+                    verbose('  Audio file found in cache')
+                    return scheduler.add(None, lambda: None)
+                verbose(f'  Calling {tts_name} for the audio file ' \
+                        f'in {len(ssml_parts)} parts')
+                for (number, ssml) in enumerate(ssml_parts):
+                    part_file = cache.path(f'{hash_hex}.{number}.{build_id}.part')
+                    temp_ts_files.extend([part_file+'.mp3', part_file+'.mrk'])
+                    tts_requests.append((ssml, part_file+'.mp3', None))
+                    if not args.ignore_subtitles:
+                        tts_requests.append((ssml, part_file+'.mrk', MARK_TYPES))
+                return scheduler.add(
+                    pools.io, finish_audio,
+                    (hash_hex, origin, len(ssml_parts), True,
+                     None if args.ignore_subtitles else 'miss'),
+                    [scheduler.add(pools.tts, tts, (request,))
+                     for request in tts_requests])
+            ssml = ssml_parts[0]
+            # Use Polly to generate the MP3 file if not in cache
+            with profiler.span('audio cache lookup', page=index+1) as span:
+                span['cache'] = 'hit' if cache.lookup(hash_hex+".mp3") else 'miss'
+            audio_fetched = span['cache'] == 'miss'
+            if audio_fetched:
+                verbose(f'  Calling {tts_name} for the audio file')
+                tts_requests.append((ssml, cache.path(hash_hex+".mp3"), None))
+            else:
+                verbose('  Audio file found in cache')
+            #
+            # Speech marks for subtitles, kept in the cache as line timings
+            #
+            marks = None
+            if not args.ignore_subtitles:
+                with profiler.span('marks cache lookup', page=index+1) as span:
+                    if cache.lookup(hash_hex+".tim"):
+                        span['cache'] = 'hit'
+                    elif cache.lookup(hash_hex+".mrk"):
+                        # Speech marks cached by an earlier version
+                        span['cache'] = 'marks'
+                    else:
+                        span['cache'] = 'miss'
+                marks = span['cache']
+                if marks == 'hit':
+                    verbose('  Speech marks found in cache')
+                elif marks == 'miss':
+                    # Use Polly to generate the speech marks JSON file,
+                    # only needed until it is converted to line timings
+                    verbose(f'  Calling {tts_name} for speech marks')
+                    marks_file = cache.path(f'{hash_hex}.{build_id}.part.mrk')
+                    temp_ts_files.append(marks_file)
+                    tts_requests.append((ssml, marks_file, MARK_TYPES))
+            return scheduler.add(
+                pools.io, finish_audio, (hash_hex, origin, 1, audio_fetched, marks),
+                [scheduler.add(pools.tts, tts, (request,))
+                 for request in tts_requests])
+        audio_files = []
+        audio_hashes = []
+        # The tasks making the audio files and line timings, by the audio hash,
+        # so that the pages with the same script share the TTS requests;
+        # the concurrent builds sharing the pools also share the tasks
+        audio_tasks = {}
         for (index, script) in enumerate(scripts):
             if index not in only:
+                audio_files.append(None)
+                audio_hashes.append(None)
                 continue
-            # Read the speech marks, keep only the start and end-of-the-line marks
-            marks_file = marks_files[index]
-            starts = {}
-            ends = {}
-            with open(marks_file, 'r', encoding='utf-8') as f:
-                for line in f.readlines():
-                    mark = json.loads(line)
-                    if mark['type'] != 'ssml':
-                        continue
-                    match = re.match(r'^s(?P<num>\d+?)$', mark['value'])
-                    if match:
-                        starts[int(match['num'])] = mark['time']
-                    match = re.match(r'^e(?P<num>\d+?)$', mark['value'])
-                    if match:
-                        ends[int(match['num'])] = mark['time']
-            #print(starts)
-            #print(ends)
-            srts = []
-            for (page_linenum, (line, _)) in enumerate(script):
-                #print(page_linenum, line)
-                if line.strip() == '':
-                    continue
-                start = starts[page_linenum]
-                end = ends[page_linenum]
-                (dummy, words, sub) = parse(line, args.neural)
+            #
+            # Audio track
+            #
+            verbose('Making the audio track %d' % (index+1))
+            with profiler.span('ssml', page=index+1):
+                (ssml_parts, hash_hex) = memo.get(
+                    ('ssml', tuple(line for (line, _) in script), args.tts,
+                     args.voice,
+                     args.neural, args.conversational, args.tts_max_chars),
+                    lambda: script_to_ssml_and_hash(script, args,
+                                                    parsed_scripts[index]))
+            origin = f'{args.script_file} #page {index+1}'
+            audio_files.append(cache.path(hash_hex+".mp3"))
+            audio_hashes.append(hash_hex)
+            if hash_hex in audio_tasks:
+                verbose('  Audio file shared with an earlier page')
+                continue
+            audio_tasks[hash_hex] = pools.shared_task(
+                ('audio', os.path.abspath(args.audio_cache), hash_hex,
+                 args.ignore_subtitles),
+                lambda: start_audio(index, hash_hex, ssml_parts, origin))
+        # Report the #pages changed since the previous build in the watch mode
+        page_keys = list(zip(audio_hashes, image_hashes))
+        if memo.pages is not None and len(memo.pages) == len(page_keys):
+            changed = [str(index+1) for index in encode_indices
+                       if memo.pages[index] != page_keys[index]]
+            verbose(f'Changed #pages: {", ".join(changed) or "none"}')
+        memo.pages = page_keys
+
+        #
+        # Make srt subtitles once the line timings of the page are ready
+        #
+        # The audio hashes whose srt file is already written in this build
+        srt_written = set()
+        def make_cues(index):
+            hash_hex = audio_hashes[index]
+            # The start and end times of the script lines
+            with profiler.span('read timings', page=index+1):
+                timings = read_timings(cache.path(hash_hex+'.tim'))
+            cues = []
+            for (page_linenum, (_, words, sub)) in enumerate(parsed_scripts[index]):
                 if len(words) == 0:
                     continue
-                srts.append({'start': start, 'end': end, 'text': sub})
-
-            srt_file = marks_file[:-4] + '.srt'
-            with open(srt_file, 'w', encoding='utf-8') as f:
-                for (srt_index, srt) in enumerate(srts):
-                    f.write(f'{srt_index+1}\n')
-                    f.write(millis_to_srt(srt['start'])+' --> '+millis_to_srt(srt['end'])+'\n')
-                    f.write(srt['text']+'\n')
-                    f.write('\n')
-
-    # Combine images and audios to transport streams
-    for (index, page_num) in enumerate(pages):
-        if index not in only:
-            continue
-        verbose(f'Combining PDF page and audio: {index+1}')
-        ts_file = f'{args.temp_prefix}-{index+1}.mp4'
-        temp_ts_files.append(ts_file)
-        audio_file = audio_files[index]
-        cmd = f'{args.ffmpeg} -y -loop 1 -i {temp_image_files[index]} ' \
-              f'-i {audio_file} -shortest -c:v libx264 ' \
-              f'-vf scale=-2:1080,format=yuv420p -c:a copy ' \
-              f'-tune stillimage d{ts_file}'
-        execute(cmd)
-        if args.ignore_subtitles:
-            os.rename(f'd{ts_file}', f'{ts_file}')
+                if page_linenum >= len(timings) or timings[page_linenum] is None:
+                    error(f'No speech marks for the line {page_linenum+1} ' \
+                          f'of the #page {index+1}')
+                cues.append(Cue(*timings[page_linenum], sub))
+            if hash_hex not in srt_written:
+                # The pages sharing the audio also share the srt file,
+                # which must not change while a segment is encoded
+                srt_written.add(hash_hex)
+                srt_file = cache.path(hash_hex+'.srt')
+                part_file = cache.path(f'{hash_hex}.{build_id}.part.srt')
+                temp_ts_files.append(part_file)
+                with profiler.span('write srt', page=index+1) as span:
+                    write_srt(cues, part_file)
+                    span['bytes_out'] = os.path.getsize(part_file)
+                    os.replace(part_file, srt_file)
+                cache.add(hash_hex+'.srt', f'{args.script_file} #page {index+1}')
+            return cues
+        # The tasks after which the audio (and the subtitles) of a page are ready
+        sound_tasks = {}
+        for index in encode_indices:
+            audio_task = audio_tasks[audio_hashes[index]]
+            if args.ignore_subtitles:
+                sound_tasks[index] = audio_task
+            else:
+                sound_tasks[index] = scheduler.add(pools.io, make_cues, (index,),
+                                                   [audio_task])
+
+        # Combine images and audios to transport streams
+        # (cache the results)
+        video_filter = f'scale=-2:{resolution},format=yuv420p'
+        if args.encoding == 'still':
+            # The page is shown as one frame per second with a keyframe
+            # every 30 seconds: the repeated frames are nearly free to encode
+            # while common players can still play and seek the video
+            input_options = '-framerate 1'
+            video_options = '-c:v libx264 -tune stillimage -r 1 -g 30'
+            # The longest interval between the keyframes in seconds
+            keyframe_interval = 30
         else:
-            verbose('  Adding subtitles')
-            srt_file = audio_file[:-4] + '.srt'
-            if os.stat(srt_file).st_size == 0:
-                os.rename(f'd{ts_file}', f'{ts_file}')
+            input_options = ''
+            video_options = '-c:v libx264 -tune stillimage'
+            # x264 makes a keyframe at least every 250 frames, at 25 fps
+            keyframe_interval = 10
+        # The final audio codec with the same parameters in all the segments,
+        # so that the segments can be concatenated without re-encoding
+        audio_options = '-c:a aac -b:a 128k -ar 44100 -ac 1'
+        if args.preview:
+            video_options += ' -preset ultrafast'
+            audio_options = '-c:a aac -b:a 64k -ar 44100 -ac 1'
+        encoder_settings = ' '.join(option for option in [input_options,
+                                                          video_filter,
+                                                          video_options,
+                                                          audio_options]
+                                    if option != '')
+        def segment_duration(segment_file):
+            # The duration in milliseconds, cached next to the segment
+            duration_file = segment_file[:-4]+'.dur'
+            duration_name = os.path.relpath(duration_file, args.audio_cache)
+            if cache.lookup(duration_name):
+                try:
+                    with open(duration_file, 'r', encoding='utf-8') as f:
+                        return float(f.read())
+                except (IOError, ValueError):
+                    pass
+            cmd = f'{args.ffprobe} -v error -show_entries format=duration ' \
+                  f'-of default=noprint_wrappers=1:nokey=1 {segment_file}'
+            try:
+                duration = float(execute(cmd).stdout.decode('utf-8')) * 1000
+            except ValueError:
+                error(f'Could not read the duration of "{segment_file}"')
+            with open(duration_file, 'w', encoding='utf-8') as f:
+                f.write(f'{duration}\n')
+            cache.add(duration_name, 'duration of ' +
+                      os.path.relpath(segment_file, args.audio_cache))
+            return duration
+        # The segment hashes of the pages looked up in the cache, and
+        # the pages whose segments are not in the cache
+        segment_hashes = {}
+        missing = set()
+        def lookup_segment(index):
+            srt_file = None if args.ignore_subtitles else \
+                audio_files[index][:-4] + '.srt'
+            hash_hex = segment_hash(image_hashes[index], audio_hashes[index],
+                                    srt_file, encoder_settings)
+            segment_hashes[index] = hash_hex
+            with profiler.span('segment cache lookup', page=index+1) as span:
+                span['cache'] = 'hit' if cache.lookup(
+                    os.path.join(segments_dir, hash_hex+'.mp4')) else 'miss'
+            if span['cache'] == 'hit':
+                verbose(f'Combined PDF page and audio {index+1} found in cache')
+            else:
+                missing.add(index)
+        # Look up the segments of the pages whose audio is already ready,
+        # so that the CPUs can be split between the encoders of the segments
+        # that are missing or cannot be looked up before their audio is made
+        # The pages encoded as separate segments
+        segment_indices = encode_indices if args.assembly == 'segments' else []
+        for index in segment_indices:
+            if sound_tasks[index].done() and \
+               sound_tasks[index].exception() is None:
+                lookup_segment(index)
+            else:
+                missing.add(index)
+        encoder_threads = pools.encoder_threads
+        if encoder_threads is None:
+            encoder_threads = encoder_plan(pools.encoders, len(missing))[1]
+        def encode(index):
+            audio_file = audio_files[index]
+            srt_file = None if args.ignore_subtitles else audio_file[:-4] + '.srt'
+            if index not in segment_hashes:
+                lookup_segment(index)
+            hash_hex = segment_hashes[index]
+            segment_name = os.path.join(segments_dir, hash_hex+'.mp4')
+            segment_file = cache.path(segment_name)
+            if index not in missing:
+                if os.path.isfile(segment_file):
+                    return segment_file
+                # Removed by other means than the cache index: encode it again
+                cache.remove(segment_name)
+            # A concurrent build encoding the same segment is waited for
+            with pools.file_lock(segment_file):
+                if cache.lookup(segment_name):
+                    verbose(f'Combined PDF page and audio {index+1} ' \
+                            f'made by another build')
+                    return segment_file
+                return encode_segment(index, audio_file, srt_file,
+                                      segment_name, segment_file)
+        def encode_segment(index, audio_file, srt_file, segment_name,
+                           segment_file):
+            if not args.stream_pages and not os.path.isfile(image_files[index]):
+                # Rendered again in the next build if removed from the cache
+                cache.remove(os.path.relpath(image_files[index], args.audio_cache))
+                error(f'Could not convert the PDF page {pages[index]} to an image')
+            verbose(f'Combining PDF page and audio: {index+1}')
+            # Encode directly into the cache, under a temporary name until ready
+            part_file = cache.path(os.path.join(
+                segments_dir, f'{segment_hashes[index]}.{build_id}.part.mp4'))
+            temp_ts_files.append(part_file)
+            if args.stream_pages:
+                # A single frame from the standard input, repeated with a filter
+                render_cmd = f'{args.pdftoppm} -png -scale-to-y {resolution} ' \
+                             f'-scale-to-x -1 -f {pages[index]} -l {pages[index]} ' \
+                             f'-singlefile {args.pdf_file}'
+                cmd = f'{args.ffmpeg} -y -f image2pipe {input_options} ' \
+                      f'-c:v png -i pipe:0 ' \
+                      f'-i {audio_file} '
+                page_filter = f'loop=loop=-1:size=1:start=0,{video_filter}'
             else:
-                cmd = f'{args.ffmpeg} -y -i d{ts_file} -i {srt_file} ' \
-                      f'-c copy -c:s mov_text -metadata:s:s:0 language=eng ' \
-                      f'{ts_file}'
+                cmd = f'{args.ffmpeg} -y -loop 1 {input_options} ' \
+                      f'-i {image_files[index]} ' \
+                      f'-i {audio_file} '
+                page_filter = video_filter
+            if srt_file is None or os.stat(srt_file).st_size == 0:
+                cmd += '-map 0:v -map 1:a '
+            else:
+                # Mux the subtitles in the same pass
+                cmd += f'-i {srt_file} -map 0:v -map 1:a -map 2:s ' \
+                       f'-c:s mov_text -metadata:s:s:0 language=eng '
+            # The length is given explicitly instead of using -shortest
+            # as the subtitle stream can end before the audio
+            cmd += f'-t {mp3_duration(audio_file):.3f} -vf {page_filter} ' \
+                   f'{video_options} {audio_options} ' \
+                   f'-threads {encoder_threads} {part_file}'
+            with profiler.span('encode', page=index+1) as span:
+                span['bytes_in'] = os.path.getsize(audio_file)
+                if not args.stream_pages:
+                    span['bytes_in'] += os.path.getsize(image_files[index])
+                if args.stream_pages:
+                    execute_pipe(render_cmd, cmd)
+                else:
+                    execute(cmd)
+                span['bytes_out'] = os.path.getsize(part_file)
+            os.replace(part_file, segment_file)
+            cache.add(segment_name, f'{args.script_file} #page {index+1}')
+            if not args.ignore_subtitles:
+                segment_duration(segment_file)
+            return segment_file
+        encode_tasks = {}
+        for index in segment_indices:
+            deps = [sound_tasks[index]]
+            if pages[index] in image_tasks:
+                deps.append(image_tasks[pages[index]])
+            encode_tasks[index] = scheduler.add(pools.encode, encode, (index,),
+                                                deps)
+        if hls:
+            # Publish the segments in the page order as soon as they are
+            # encoded, remuxed to transport streams (cut at the keyframes)
+            # continuing the timeline of the preceding pages. The streams
+            # are named by the segment and its start time, so that a rebuild
+            # only replaces the streams of the changed and moved pages
+            hls_dir = output_root+'-hls'
+            make_dir(hls_dir)
+            media_playlist = output_root+'-video.m3u8'
+            subtitles_playlist = None if args.ignore_subtitles else \
+                output_root+'-subtitles.m3u8'
+            write_master_playlist(args.output_file,
+                                  os.path.basename(media_playlist),
+                                  None if subtitles_playlist is None else
+                                  os.path.basename(subtitles_playlist))
+            # The streams are cut at the keyframes, so none is longer than
+            # the keyframe interval: the target duration of a playlist
+            # must not change once it has been published
+            hls_target = keyframe_interval
+            hls_streams = []
+            hls_subtitles = []
+            hls_files = set()
+            hls_offset = [0]
+            def write_playlists(ended):
+                write_media_playlist(media_playlist, hls_target,
+                                     hls_streams, ended)
+                if subtitles_playlist is not None:
+                    write_media_playlist(subtitles_playlist, hls_target,
+                                         hls_subtitles, ended)
+            def publish(index):
+                segment_file = encode_tasks[index].result()
+                offset = hls_offset[0]
+                key = f'{segment_hashes[index][:16]}-{round(offset)}'
+                page_playlist = os.path.join(hls_dir, key+'.m3u8')
+                if not os.path.isfile(page_playlist):
+                    part_file = os.path.join(hls_dir, key+'.part.m3u8')
+                    temp_ts_files.append(part_file)
+                    # The subtitles are published as WebVTT segments instead
+                    cmd = f'{args.ffmpeg} -y -i {segment_file} ' \
+                          f'-map 0:v -map 0:a -c copy -f hls -hls_time 1 ' \
+                          f'-hls_playlist_type vod -hls_segment_filename ' \
+                          f'{os.path.join(hls_dir, key)}-%d.ts ' \
+                          f'-muxdelay 0 -muxpreload 0 -output_ts_offset ' \
+                          f'{HLS_START + offset / 1000:.3f} {part_file}'
+                    with profiler.span('hls remux', page=index+1):
+                        execute(cmd)
+                    os.replace(part_file, page_playlist)
+                hls_files.add(key+'.m3u8')
+                start = offset
+                for (number, (duration, uri)) in \
+                        enumerate(read_media_playlist(page_playlist)):
+                    hls_streams.append((duration, os.path.basename(hls_dir)+
+                                        '/'+uri))
+                    hls_files.add(uri)
+                    if subtitles_playlist is not None:
+                        vtt_name = f'{key}-{number}.vtt'
+                        write_vtt_segment([cue.shifted(offset) for cue in
+                                           sound_tasks[index].result()],
+                                          start, start + 1000 * duration,
+                                          os.path.join(hls_dir, vtt_name))
+                        hls_subtitles.append((duration, os.path.basename(hls_dir)+
+                                              '/'+vtt_name))
+                        hls_files.add(vtt_name)
+                    start += 1000 * duration
+                hls_offset[0] += segment_duration(segment_file)
+                write_playlists(False)
+                verbose(f'Published the page {index+1} in "{args.output_file}"')
+            previous = None
+            for index in encode_indices:
+                previous = scheduler.add(pools.io, publish, (index,),
+                                         [encode_tasks[index]] +
+                                         ([] if previous is None else [previous]))
+        with profiler.span('pipeline', encoders=pools.encoders,
+                           threads=encoder_threads):
+            scheduler.wait()
+        page_cues = [None] * len(scripts)
+        if not args.ignore_subtitles:
+            for index in encode_indices:
+                page_cues[index] = sound_tasks[index].result()
+
+        if args.assembly == 'single':
+            # Encode the whole video with one FFmpeg filter graph: each page
+            # image is scaled once and then looped for the duration of its
+            # audio, rounded up to whole video frames (the audio is padded
+            # with silence to match), and the pages are joined with
+            # the concat filter. The pages are looped at the default frame
+            # rate to keep their durations exact; the still encoding then
+            # drops the extra frames
+            frame_rate = 25
+            durations = []
+            inputs = ''
+            graph = []
+            for (number, index) in enumerate(encode_indices):
+                if not os.path.isfile(image_files[index]):
+                    error(f'Could not convert the PDF page {pages[index]} ' \
+                          f'to an image')
+                duration = math.ceil(mp3_duration(audio_files[index]) *
+                                     frame_rate) / frame_rate
+                durations.append(1000 * duration)
+                inputs += f'-framerate {frame_rate} -i {image_files[index]} ' \
+                          f'-i {audio_files[index]} '
+                graph.append(f'[{2*number}:v]{video_filter},' \
+                             f'loop=loop={round(duration * frame_rate) - 1}:' \
+                             f'size=1[v{number}];' \
+                             f'[{2*number+1}:a]aformat=sample_rates=44100:' \
+                             f'channel_layouts=mono,' \
+                             f'apad=whole_dur={duration:.3f}[a{number}];')
+            graph.append(''.join(f'[v{number}][a{number}]' for number
+                                 in range(len(encode_indices))) +
+                         f'concat=n={len(encode_indices)}:v=1:a=1[v][a]')
+            # The graph of a long deck would not fit on the command line
+            graph_file = f'{args.temp_prefix}.graph'
+            temp_ts_files.append(graph_file)
+            with open(graph_file, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(graph) + '\n')
+            maps = '-map [v] -map [a] '
+            if not args.ignore_subtitles:
+                cues = concatenate_cues([page_cues[index]
+                                         for index in encode_indices],
+                                        durations)
+                if len(cues) > 0:
+                    srt_file = f'{args.temp_prefix}.srt'
+                    temp_ts_files.append(srt_file)
+                    write_srt(cues, srt_file)
+                    inputs += f'-i {srt_file} '
+                    maps += f'-map {2*len(encode_indices)}:s -c:s mov_text ' \
+                            f'-metadata:s:s:0 language=eng '
+            cmd = f'{args.ffmpeg} -y {inputs}' \
+                  f'-filter_complex_script {graph_file} {maps}' \
+                  f'-t {sum(durations) / 1000:.3f} {video_options} ' \
+                  f'{audio_options} {args.output_file}'
+            verbose(f'Encoding the video "{args.output_file}"')
+            with profiler.span('encode video', pages=len(encode_indices)) as span:
                 execute(cmd)
-                unlink(f'd{ts_file}')
-
-    # Combine the transport streams
-    verbose(f'Combining the transport streams to "{args.output_file}"')
-    lst_file = f'{args.temp_prefix}.lst'
-    with open(lst_file, 'w', encoding='utf-8') as f:
-        for ts_file in temp_ts_files:
-            f.write(f'file {ts_file}\n')
-    cmd = f'{args.ffmpeg} -y -f concat -i {lst_file} -c:v copy -c:a aac ' \
-          f'-c:s copy -strict -2 {args.output_file}'
-    execute(cmd)
-
-    if not args.ignore_subtitles:
-        # Produce the WebVTT subtitles (for HTML)
-        vtt_file = args.output_file[:-4]+'.vtt'
-        verbose(f'Producing WebVTT subtitles at "{vtt_file}"')
-        cmd = f'{args.ffmpeg} -y -i {args.output_file} {vtt_file}'
-        execute(cmd)
-
-    clean_temps()
+                span['bytes_out'] = os.path.getsize(args.output_file)
+        else:
+            # The segments are listed in the page order, not in the
+            # completion order
+            segment_files = [encode_tasks[index].result()
+                             for index in encode_indices]
+            if not args.ignore_subtitles:
+                with profiler.span('segment durations'):
+                    durations = [segment_duration(segment_file)
+                                 for segment_file in segment_files]
+            if hls:
+                write_playlists(True)
+                # Remove the streams replaced in this build
+                for file_name in os.listdir(hls_dir):
+                    if file_name not in hls_files:
+                        unlink(os.path.join(hls_dir, file_name))
+            else:
+                # Combine the transport streams
+                verbose(f'Combining the transport streams to "{args.output_file}"')
+                lst_file = f'{args.temp_prefix}.lst'
+                with open(lst_file, 'w', encoding='utf-8') as f:
+                    for segment_file in segment_files:
+                        f.write(concat_list_entry(segment_file))
+                # The concat demuxer takes the streams from the first
+                # segment, which has no subtitles if its page has no cues,
+                # so the subtitles of the whole video are muxed here instead
+                inputs = f'-f concat -safe 0 -i {lst_file} '
+                maps = '-map 0:v -map 0:a -c copy '
+                if not args.ignore_subtitles:
+                    cues = concatenate_cues([page_cues[index]
+                                             for index in encode_indices],
+                                            durations)
+                    if len(cues) > 0:
+                        srt_file = f'{args.temp_prefix}.srt'
+                        temp_ts_files.append(srt_file)
+                        write_srt(cues, srt_file)
+                        inputs += f'-i {srt_file} '
+                        maps += '-map 1:s -c:s mov_text ' \
+                                '-metadata:s:s:0 language=eng '
+                cmd = f'{args.ffmpeg} -y {inputs}{maps}{args.output_file}'
+                with profiler.span('concat', segments=len(segment_files)) as span:
+                    execute(cmd)
+                    span['bytes_out'] = os.path.getsize(args.output_file)
+
+        if not args.ignore_subtitles:
+            # Produce the subtitles of the whole video (WebVTT for HTML),
+            # shifting the page subtitles by the durations of the preceding pages
+            cues = concatenate_cues([page_cues[index] for index in encode_indices],
+                                    durations)
+            for subtitle_format in subtitle_formats:
+                subtitle_file = output_root+'.'+subtitle_format
+                verbose(f'Producing {subtitle_format.upper()} subtitles at ' \
+                        f'"{subtitle_file}"')
+                with profiler.span('write subtitles', format=subtitle_format):
+                    WRITERS[subtitle_format](cues, subtitle_file)
+
+        # Keep the cache within the size and age limits
+        if own_cache and (args.cache_max_size is not None or
+                          args.cache_max_age is not None):
+            evicted = cache.gc(args.cache_max_size, args.cache_max_age,
+                               keep=cache.accessed_since(build_start))
+            if len(evicted) > 0:
+                verbose(f'Evicted {len(evicted)} files from the cache')
+    except FileNotFoundError as err:
+        # The lookups trust the cache index: a cached file removed by other
+        # means is dropped from the index, so that the next build makes it
+        cache_dir = os.path.abspath(args.audio_cache)
+        if cache is None or err.filename is None or \
+           not os.path.abspath(err.filename).startswith(cache_dir+os.sep):
+            raise
+        cache.remove(os.path.relpath(os.path.abspath(err.filename), cache_dir))
+        error(f'The cached file "{err.filename}" has been removed; ' \
+              f'it is made again in the next build')
+    finally:
+        # The tasks of a failed build may still be running, and shared
+        # with other builds: let them finish before removing their files
+        try:
+            scheduler.wait()
+        except Exception:
+            pass
+        clean_temps()
+        if own_cache and cache is not None:
+            cache.save()
+        if own_pools and pools is not None:
+            pools.shutdown()
+
+
+def file_stamps(file_names):
+    """The modification times and sizes of the files (None if missing)."""
+    stamps = []
+    for file_name in file_names:
+        try:
+            stat = os.stat(file_name)
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+
+def watch(args, profiler):
+    """
+    Build the video, and then again whenever the PDF or the script file
+    changes, until interrupted. The worker pools, the cache index and
+    the in-memory results are kept between the builds, so a rebuild
+    only redoes the work for the changed pages and the final video.
+    """
+    pools = BuildPools(cpu_count(), tts_workers(args), args.tts_rate,
+                       encoder_plan(args.jobs, cpu_count())[0])
+    cache = CacheIndex(args.audio_cache)
+    memo = BuildMemo()
+    files = [args.pdf_file, args.script_file]
+    stamps = None
+    try:
+        while True:
+            if file_stamps(files) == stamps:
+                time.sleep(WATCH_INTERVAL)
+                continue
+            # Wait until the files are no longer being written
+            stamps = file_stamps(files)
+            time.sleep(WATCH_INTERVAL)
+            if file_stamps(files) != stamps:
+                continue
+            start = time.perf_counter()
+            build_start = time.time()
+            try:
+                build(args, pools, cache, profiler, memo=memo)
+                print(f'Built "{args.output_file}" in ' \
+                      f'{time.perf_counter() - start:.1f}s')
+            except BuildError as err:
+                print(f'Build failed: {err}')
+            if os.path.isdir(args.audio_cache):
+                if args.cache_max_size is not None or \
+                   args.cache_max_age is not None:
+                    cache.gc(args.cache_max_size, args.cache_max_age,
+                             keep=cache.accessed_since(build_start))
+                cache.save()
+            print(f'Watching "{args.pdf_file}" and "{args.script_file}" ' \
+                  f'for changes, press Ctrl-C to stop')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pools.shutdown()
+
+
+def main():
+    """The main routine."""
+    if len(sys.argv) > 1 and sys.argv[1] == 'cache':
+        cache_main(sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        from .batch import batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+    argp = make_arg_parser()
+    args = argp.parse_args()
+    profiler = Profiler(enabled=args.profile is not None)
+    def write_profile():
+        if args.profile is not None:
+            profiler.write_chrome_trace(args.profile)
+            print(profiler.summary())
+    if args.watch:
+        watch(args, profiler)
+        write_profile()
+        sys.exit(0)
+    try:
+        build(args, profiler=profiler)
+    except BuildError as err:
+        write_profile()
+        argp.exit(1, str(err)+'\n')
+    write_profile()
     sys.exit(0)
 
 
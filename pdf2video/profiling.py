@@ -0,0 +1,84 @@
+"""
+Timing instrumentation for pdf2video builds.
+Author: T. Junttila
+License: The MIT License
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+class Profiler:
+    """
+    Records timed spans of the build stages and the executed subprocesses.
+    The spans can be written in the Chrome trace event format,
+    viewable in chrome://tracing or https://ui.perfetto.dev/.
+    A disabled profiler records nothing.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.spans = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, category='stage', **args):
+        """
+        Time the enclosed block as a span with the name and the arguments.
+        The arguments dictionary is yielded so that the block can
+        add details, such as cache hits or byte counts, to it.
+        """
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            if self.enabled:
+                end = time.perf_counter()
+                with self.lock:
+                    self.spans.append((name, category, start - self.origin,
+                                       end - start, threading.get_ident(),
+                                       args))
+
+    def write_chrome_trace(self, file_name):
+        """Write the spans as complete events in the Chrome trace format."""
+        with self.lock:
+            spans = list(self.spans)
+        thread_ids = {}
+        events = []
+        for (name, category, start, duration, thread, args) in spans:
+            tid = thread_ids.setdefault(thread, len(thread_ids))
+            events.append({'name': name, 'cat': category, 'ph': 'X',
+                           'ts': round(start * 1e6, 1),
+                           'dur': round(duration * 1e6, 1),
+                           'pid': os.getpid(), 'tid': tid,
+                           'args': {key: value if isinstance(value, (int, float))
+                                    else str(value)
+                                    for (key, value) in args.items()}})
+        with open(file_name, 'w', encoding='utf-8') as file_handle:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                      file_handle)
+
+    def summary(self):
+        """A table of the number, total, mean and maximum times of the spans."""
+        with self.lock:
+            spans = list(self.spans)
+        totals = {}
+        order = []
+        for (name, category, _, duration, _, _) in spans:
+            key = (category, name)
+            if key not in totals:
+                totals[key] = []
+                order.append(key)
+            totals[key].append(duration)
+        lines = [f'{"span":<28} {"count":>6} {"total s":>9} ' \
+                 f'{"mean ms":>9} {"max ms":>9}']
+        for (category, name) in order:
+            durations = totals[(category, name)]
+            label = name if category == 'stage' else f'  [{name}]'
+            lines.append(f'{label:<28} {len(durations):>6} ' \
+                         f'{sum(durations):>9.2f} ' \
+                         f'{1000 * sum(durations) / len(durations):>9.1f} ' \
+                         f'{1000 * max(durations):>9.1f}')
+        return '\n'.join(lines)
@@ -0,0 +1,92 @@
+"""
+Running a graph of dependent tasks in worker pools.
+Author: T. Junttila
+License: The MIT License
+"""
+
+from concurrent.futures import Future
+import threading
+
+class Scheduler:
+    """
+    Runs tasks as soon as the tasks they depend on have completed,
+    each in the given executor (worker pool), so that independent
+    work in different pools overlaps. A task depending on a failed task
+    fails with the same exception without being run.
+    """
+    def __init__(self):
+        self.tasks = []
+        self.lock = threading.Lock()
+
+    def add(self, executor, function, args=(), deps=()):
+        """
+        Add a task calling the function with the arguments once the tasks
+        in deps have completed. If executor is None, the function is called
+        directly in the thread completing the last dependency, which is
+        only suitable for short functions.
+        Returns the task as a Future of the function's result.
+        """
+        task = Future()
+        deps = list(deps)
+        remaining = [len(deps)]
+        def run():
+            if not task.set_running_or_notify_cancel():
+                return
+            try:
+                task.set_result(function(*args))
+            except BaseException as err:
+                task.set_exception(err)
+        def copy_result(future):
+            if future.exception() is not None:
+                task.set_exception(future.exception())
+            else:
+                task.set_result(future.result())
+        def start():
+            for dep in deps:
+                if dep.exception() is not None:
+                    task.set_exception(dep.exception())
+                    return
+            if executor is None:
+                run()
+                return
+            if not task.set_running_or_notify_cancel():
+                return
+            try:
+                future = executor.submit(function, *args)
+            except RuntimeError as err:
+                # The executor has been shut down
+                task.set_exception(err)
+                return
+            future.add_done_callback(copy_result)
+        def dep_done(_):
+            with self.lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                start()
+        with self.lock:
+            self.tasks.append(task)
+        if len(deps) == 0:
+            start()
+        for dep in deps:
+            dep.add_done_callback(dep_done)
+        return task
+
+    def wait(self):
+        """
+        Wait until all the tasks have completed or failed.
+        Raises the exception of the first failed task, if any.
+        """
+        first_error = None
+        index = 0
+        while True:
+            with self.lock:
+                if index >= len(self.tasks):
+                    break
+                task = self.tasks[index]
+            index += 1
+            error = task.exception()
+            if error is not None and first_error is None:
+                first_error = error
+        if first_error is not None:
+            raise first_error
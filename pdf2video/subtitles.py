@@ -0,0 +1,128 @@
+"""
+Subtitle file formats for pdf2video.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import json
+
+class Cue:
+    """A subtitle text shown from start to end (in milliseconds)."""
+    __slots__ = ('start', 'end', 'text')
+    def __init__(self, start, end, text):
+        self.start = start
+        self.end = end
+        self.text = text
+    def shifted(self, offset):
+        """The same cue shifted later by offset milliseconds."""
+        return Cue(self.start + offset, self.end + offset, self.text)
+
+def _split_millis(millis):
+    """Split milliseconds to (hours, minutes, seconds, milliseconds)."""
+    millis = int(round(millis))
+    return (millis // 3600000, (millis // 60000) % 60,
+            (millis // 1000) % 60, millis % 1000)
+
+def millis_to_srt(millis):
+    """Convert milliseconds time to the SRT subtitles format time string."""
+    return '%02d:%02d:%02d,%03d' % _split_millis(millis)
+
+def millis_to_vtt(millis):
+    """Convert milliseconds time to the WebVTT subtitles format time string."""
+    return '%02d:%02d:%02d.%03d' % _split_millis(millis)
+
+def write_srt(cues, file_name):
+    """Write the cues to a SRT file."""
+    with open(file_name, 'w', encoding='utf-8') as file_handle:
+        for (index, cue) in enumerate(cues):
+            file_handle.write(f'{index+1}\n')
+            file_handle.write(millis_to_srt(cue.start)+' --> '+
+                              millis_to_srt(cue.end)+'\n')
+            file_handle.write(cue.text+'\n')
+            file_handle.write('\n')
+
+def write_vtt(cues, file_name):
+    """Write the cues to a WebVTT file."""
+    with open(file_name, 'w', encoding='utf-8') as file_handle:
+        file_handle.write('WEBVTT\n\n')
+        for cue in cues:
+            file_handle.write(millis_to_vtt(cue.start)+' --> '+
+                              millis_to_vtt(cue.end)+'\n')
+            file_handle.write(cue.text+'\n')
+            file_handle.write('\n')
+
+# The supported subtitle formats, keyed by the file name extension
+WRITERS = {'srt': write_srt, 'vtt': write_vtt}
+
+def concatenate_cues(pages_cues, durations):
+    """
+    Combine the cues of consecutive pages into the cues of the whole video.
+    The cues of each page are shifted by the total duration
+    (in milliseconds) of the preceding pages.
+    """
+    cues = []
+    offset = 0
+    for (page_cues, duration) in zip(pages_cues, durations):
+        cues.extend(cue.shifted(offset) for cue in page_cues)
+        offset += duration
+    return cues
+
+# The speech mark types needed for timing the subtitles:
+# the SSML marks at the start and the end of each script line
+MARK_TYPES = ['ssml']
+
+def read_speech_marks(marks_file):
+    """
+    Read the line timings from a JSON lines speech marks file.
+    Returns a list of (start, end) pairs in milliseconds indexed by the
+    script line number, None for the lines without both marks.
+    """
+    starts = {}
+    ends = {}
+    with open(marks_file, 'r', encoding='utf-8') as file_handle:
+        for line in file_handle:
+            # Skip the word and viseme marks without decoding them
+            if '"ssml"' not in line:
+                continue
+            mark = json.loads(line)
+            value = mark['value']
+            if mark['type'] != 'ssml' or not value[1:].isdigit():
+                continue
+            if value[0] == 's':
+                starts[int(value[1:])] = mark['time']
+            elif value[0] == 'e':
+                ends[int(value[1:])] = mark['time']
+    nof_lines = max(list(starts) + list(ends), default=-1) + 1
+    return [(starts[num], ends[num]) if num in starts and num in ends else None
+            for num in range(nof_lines)]
+
+def write_timings(timings, file_name):
+    """Write the line timings compactly, one "start end" line per script line."""
+    with open(file_name, 'w', encoding='utf-8') as file_handle:
+        for timing in timings:
+            file_handle.write('-\n' if timing is None else '%d %d\n' % timing)
+
+def read_timings(file_name):
+    """Read the line timings written with write_timings."""
+    timings = []
+    with open(file_name, 'r', encoding='utf-8') as file_handle:
+        for line in file_handle:
+            fields = line.split()
+            timings.append((int(fields[0]), int(fields[1]))
+                           if len(fields) == 2 else None)
+    return timings
+
+def join_timings(chunks_timings, offsets):
+    """
+    Join the line timings of consecutive audio chunks, shifting the times
+    of each chunk by its offset in milliseconds. The lines are numbered
+    over all the chunks and each line is timed in one of them.
+    """
+    timings = []
+    for (chunk_timings, offset) in zip(chunks_timings, offsets):
+        for (num, timing) in enumerate(chunk_timings):
+            if timing is None:
+                continue
+            timings.extend([None] * (num + 1 - len(timings)))
+            timings[num] = (timing[0] + offset, timing[1] + offset)
+    return timings
@@ -0,0 +1,354 @@
+"""
+Text-to-speech synthesis for pdf2video.
+Author: T. Junttila
+License: The MIT License
+"""
+
+from concurrent.futures import Future
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+from subprocess import PIPE
+import tempfile
+import threading
+import time
+import wave
+
+from .profiling import Profiler
+
+# Substrings of the error messages that tell that
+# a request was rejected because of too high a request rate
+THROTTLING_ERRORS = ['ThrottlingException', 'TooManyRequests',
+                     'Throttling', 'Rate exceeded', 'SlowDown']
+
+class TTSError(Exception):
+    """A failed TTS request."""
+    def __init__(self, msg, throttled=False):
+        super().__init__(msg)
+        self.throttled = throttled
+
+def part_name(output_file):
+    """
+    The temporary name of the output file until it is complete,
+    unique to the writing thread as concurrent builds may make the same files.
+    """
+    return f'{output_file}.{os.getpid()}-{threading.get_ident()}.part'
+
+def is_throttling_error(msg):
+    """Does the error message tell that the request was throttled?"""
+    return any(text in msg for text in THROTTLING_ERRORS)
+
+class TokenBucket:
+    """A thread-safe token bucket limiting the rate of requests."""
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = self.capacity
+        self.time = time.monotonic()
+        self.lock = threading.Lock()
+    def acquire(self):
+        """Wait until a token is available and consume it."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.time) * self.rate)
+                self.time = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class PollyCLI:
+    """
+    A Polly client that runs the AWS command line tool for each request.
+    A client only needs the synthesize method, so any object providing it
+    (for instance, a stub faking the responses) can be used instead.
+    """
+    def __init__(self, voice, neural, profile='default', aws='aws',
+                 endpoint_url=None):
+        self.voice = voice
+        self.neural = neural
+        self.profile = profile
+        self.aws = aws
+        self.endpoint_url = endpoint_url
+    def synthesize(self, ssml, output_file, speech_mark_types=None):
+        """
+        Synthesize the SSML into the output file: an MP3 file or,
+        if speech mark types are given, a JSON lines speech marks file.
+        """
+        (fd, ssml_file) = tempfile.mkstemp(suffix='.ssml')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file_handle:
+            file_handle.write(ssml)
+        part_file = part_name(output_file)
+        cmd = [self.aws]
+        if self.profile != 'default':
+            cmd += ['--profile', self.profile]
+        if self.endpoint_url is not None:
+            cmd += ['--endpoint-url', self.endpoint_url]
+        cmd += ['polly', 'synthesize-speech',
+                '--text-type', 'ssml', '--text', 'file://'+ssml_file,
+                '--voice-id', self.voice]
+        if speech_mark_types:
+            cmd += ['--output-format', 'json', '--speech-mark-types']
+            cmd += list(speech_mark_types)
+        else:
+            cmd += ['--output-format', 'mp3']
+        if self.neural:
+            cmd += ['--engine', 'neural']
+        cmd += [part_file]
+        try:
+            exec_result = subprocess.run(cmd, stdout=PIPE, stderr=PIPE,
+                                         check=False)
+        except Exception as err:
+            raise TTSError(f'Error when executing "{" ".join(cmd)}".\n'+str(err))
+        finally:
+            os.unlink(ssml_file)
+        if exec_result.returncode != 0:
+            stderr = exec_result.stderr.decode('utf-8')
+            raise TTSError(f'Error when executing "{" ".join(cmd)}". ' \
+                           f'The last 10 lines of the stderr output ' \
+                           f'is as follows:\n' +
+                           '\n'.join(stderr.split('\n')[-11:]),
+                           is_throttling_error(stderr))
+        os.replace(part_file, output_file)
+
+class PollyBoto3:
+    """
+    A Polly client that calls the service in-process with boto3.
+    All the requests share one client and thus one pool of persistent
+    HTTP connections, avoiding process startup, credential resolution
+    and TLS handshakes for each request.
+    """
+    def __init__(self, voice, neural, profile='default', endpoint_url=None,
+                 max_connections=10):
+        import boto3
+        from botocore.config import Config
+        import botocore.exceptions
+        self.voice = voice
+        self.neural = neural
+        self.exceptions = botocore.exceptions
+        # Retries are handled by synthesize
+        config = Config(max_pool_connections=max_connections,
+                        retries={'max_attempts': 1, 'mode': 'standard'})
+        try:
+            session = boto3.session.Session(
+                profile_name=None if profile == 'default' else profile)
+            self.client = session.client('polly', endpoint_url=endpoint_url,
+                                         config=config)
+        except self.exceptions.BotoCoreError as err:
+            raise TTSError(f'Could not create a Polly client: {err}')
+    def synthesize(self, ssml, output_file, speech_mark_types=None):
+        """
+        Synthesize the SSML into the output file: an MP3 file or,
+        if speech mark types are given, a JSON lines speech marks file.
+        """
+        params = {'Text': ssml, 'TextType': 'ssml', 'VoiceId': self.voice}
+        if speech_mark_types:
+            params['OutputFormat'] = 'json'
+            params['SpeechMarkTypes'] = list(speech_mark_types)
+        else:
+            params['OutputFormat'] = 'mp3'
+        if self.neural:
+            params['Engine'] = 'neural'
+        part_file = part_name(output_file)
+        try:
+            response = self.client.synthesize_speech(**params)
+            with open(part_file, 'wb') as file_handle:
+                stream = response['AudioStream']
+                for chunk in iter(lambda: stream.read(65536), b''):
+                    file_handle.write(chunk)
+        except self.exceptions.ClientError as err:
+            code = err.response.get('Error', {}).get('Code', '')
+            raise TTSError(f'Polly request failed: {err}',
+                           is_throttling_error(code))
+        except self.exceptions.BotoCoreError as err:
+            raise TTSError(f'Polly request failed: {err}')
+        os.replace(part_file, output_file)
+
+class EspeakNG:
+    """
+    An offline TTS client running the espeak-ng synthesizer locally,
+    for fast draft builds without network access or request limits.
+    The text between consecutive SSML marks is synthesized separately,
+    so that the speech marks can be timed by the durations of the pieces,
+    and the audio is converted to MP3 with FFmpeg. The audio and the
+    speech marks of an SSML document are made in one synthesis.
+    """
+    # The requests do not need to be limited by a shared request rate
+    rate_limited = False
+    def __init__(self, voice, espeak='espeak-ng', ffmpeg='ffmpeg'):
+        self.voice = voice
+        self.espeak = espeak
+        self.ffmpeg = ffmpeg
+        # The recent and ongoing syntheses by the SSML, as futures of
+        # the audio (kept until it is requested) and the speech marks
+        self.syntheses = {}
+        self.lock = threading.Lock()
+    def _run(self, cmd, input_bytes=None):
+        try:
+            exec_result = subprocess.run(cmd, input=input_bytes, stdout=PIPE,
+                                         stderr=PIPE, check=False)
+        except Exception as err:
+            raise TTSError(f'Error when executing "{" ".join(cmd)}".\n'+str(err))
+        if exec_result.returncode != 0:
+            raise TTSError(f'Error when executing "{" ".join(cmd)}". ' \
+                           f'The last 10 lines of the stderr output ' \
+                           f'is as follows:\n' +
+                           '\n'.join(exec_result.stderr.decode('utf-8')
+                                     .split('\n')[-11:]))
+    def _synthesize_wav(self, ssml, wav_file, temp_dir):
+        """
+        Synthesize the SSML into the WAV file.
+        Returns the speech marks as (time in milliseconds, mark name) pairs.
+        """
+        # Polly specific elements, such as <amazon:domain>, are left out
+        body = re.sub(r'</?(speak|amazon:[a-z-]+)\b[^>]*>', '', ssml)
+        pieces = re.split(r'<mark name="([^"]*)"/>', body)
+        marks = []
+        params = None
+        frames = []
+        millis = 0
+        for (number, text) in enumerate(pieces):
+            if number % 2 == 1:
+                # A mark between the pieces of text
+                marks.append((round(millis), text))
+                continue
+            if text.strip() == '':
+                continue
+            piece_file = os.path.join(temp_dir, f'{number}.wav')
+            self._run([self.espeak, '-v', self.voice, '-m', '--stdin',
+                       '-w', piece_file],
+                      ('<speak>'+text+'</speak>').encode('utf-8'))
+            with wave.open(piece_file, 'rb') as wav:
+                if params is None:
+                    params = wav.getparams()
+                millis += 1000 * wav.getnframes() / wav.getframerate()
+                frames.append(wav.readframes(wav.getnframes()))
+        if params is None:
+            # Nothing to speak: a short silence
+            params = (1, 2, 22050, 0, 'NONE', 'not compressed')
+            frames.append(bytes(2 * 22050 // 10))
+        with wave.open(wav_file, 'wb') as wav:
+            wav.setparams(params)
+            for data in frames:
+                wav.writeframes(data)
+        return marks
+    def _synthesize_mp3(self, ssml):
+        """Synthesize the SSML into MP3 data and the speech marks."""
+        temp_dir = tempfile.mkdtemp(prefix='pdf2video-espeak-')
+        try:
+            wav_file = os.path.join(temp_dir, 'audio.wav')
+            mp3_file = os.path.join(temp_dir, 'audio.mp3')
+            marks = self._synthesize_wav(ssml, wav_file, temp_dir)
+            self._run([self.ffmpeg, '-y', '-v', 'error', '-i', wav_file,
+                       '-c:a', 'libmp3lame', '-q:a', '4', '-f', 'mp3',
+                       mp3_file])
+            with open(mp3_file, 'rb') as file_handle:
+                audio = file_handle.read()
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        return {'audio': audio, 'marks': marks}
+    def _take(self, ssml, kind):
+        """
+        Get the 'audio' or the 'marks' of the SSML, waiting for the ongoing
+        synthesis of the same SSML for the other one if there is one.
+        """
+        while True:
+            with self.lock:
+                future = self.syntheses.get(ssml)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self.syntheses[ssml] = future
+                    if len(self.syntheses) > 100:
+                        # The other result was not requested, forget it
+                        del self.syntheses[next(iter(self.syntheses))]
+            if owner:
+                try:
+                    future.set_result(self._synthesize_mp3(ssml))
+                except BaseException as err:
+                    with self.lock:
+                        if self.syntheses.get(ssml) is future:
+                            del self.syntheses[ssml]
+                    future.set_exception(err)
+            result = future.result()
+            with self.lock:
+                if kind in result:
+                    if kind == 'audio':
+                        return result.pop('audio')
+                    return result[kind]
+                # The audio has already been taken: synthesize again
+                if self.syntheses.get(ssml) is future:
+                    del self.syntheses[ssml]
+    def synthesize(self, ssml, output_file, speech_mark_types=None):
+        """
+        Synthesize the SSML into the output file: an MP3 file or,
+        if speech mark types are given, a JSON lines speech marks file
+        with the SSML marks.
+        """
+        part_file = part_name(output_file)
+        if speech_mark_types:
+            with open(part_file, 'w', encoding='utf-8') as file_handle:
+                for (millis, name) in self._take(ssml, 'marks'):
+                    file_handle.write(json.dumps(
+                        {'time': millis, 'type': 'ssml', 'start': 0,
+                         'end': 0, 'value': name}) + '\n')
+        else:
+            with open(part_file, 'wb') as file_handle:
+                file_handle.write(self._take(ssml, 'audio'))
+        os.replace(part_file, output_file)
+
+def make_polly_client(kind, voice, neural, profile='default',
+                      endpoint_url=None, max_connections=10):
+    """
+    Make a Polly client of the given kind: 'boto3' for the in-process client,
+    'cli' for the AWS command line tool, or 'auto' for the in-process client
+    if boto3 is installed and the command line tool otherwise.
+    """
+    if kind in ('auto', 'boto3'):
+        try:
+            return PollyBoto3(voice, neural, profile, endpoint_url,
+                              max_connections)
+        except ImportError:
+            if kind == 'boto3':
+                raise TTSError('The boto3 package is required by ' \
+                               'the in-process Polly client')
+    return PollyCLI(voice, neural, profile, endpoint_url=endpoint_url)
+
+def synthesize(client, request, bucket, retries=5, backoff=0.5,
+               verbose=print, profiler=None):
+    """
+    Execute a TTS request, a tuple (ssml, output_file, speech_mark_types),
+    with the client once the token bucket (if any) allows it.
+    Throttled requests are retried with exponential backoff.
+    Raises TTSError if the request fails.
+    """
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    (ssml, output_file, speech_mark_types) = request
+    attempt = 0
+    while True:
+        if bucket is not None:
+            with profiler.span('rate limit wait', 'tts'):
+                bucket.acquire()
+        try:
+            with profiler.span('polly', 'tts', file=output_file,
+                               attempt=attempt,
+                               bytes_in=len(ssml.encode('utf-8'))) as span:
+                client.synthesize(ssml, output_file, speech_mark_types)
+                span['bytes_out'] = os.path.getsize(output_file)
+            return
+        except TTSError as err:
+            if not err.throttled or attempt >= retries:
+                raise
+        delay = backoff * (2 ** attempt) * (1 + random.random())
+        attempt += 1
+        verbose(f'  TTS request throttled, retrying in {delay:.1f}s')
+        time.sleep(delay)
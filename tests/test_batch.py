@@ -0,0 +1,62 @@
+"""
+Tests for reading the batch manifests and the job options.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import json
+import sys
+
+import pytest
+
+from pdf2video.batch import job_argv, options_to_argv, read_manifest
+
+JOB = {'pdf_file': 'a.pdf', 'script_file': 'a.txt', 'output_file': 'a.mp4'}
+
+def test_read_json_manifest(tmp_path):
+    manifest_file = tmp_path / 'm.json'
+    manifest_file.write_text(json.dumps({'options': {'neural': True},
+                                         'jobs': [JOB]}))
+    assert read_manifest(str(manifest_file)) == \
+        {'options': {'neural': True}, 'jobs': [JOB]}
+
+def test_read_toml_manifest(tmp_path):
+    if sys.version_info < (3, 11):
+        pytest.importorskip('tomli')
+    manifest_file = tmp_path / 'm.toml'
+    manifest_file.write_text('[options]\nvoice = "Matthew"\n\n'
+                             '[[jobs]]\npdf_file = "a.pdf"\n'
+                             'script_file = "a.txt"\noutput_file = "a.mp4"\n')
+    assert read_manifest(str(manifest_file)) == \
+        {'options': {'voice': 'Matthew'}, 'jobs': [JOB]}
+
+@pytest.mark.parametrize('manifest', [[JOB], {'jobs': JOB}, {}])
+def test_manifest_without_jobs(tmp_path, manifest):
+    manifest_file = tmp_path / 'm.json'
+    manifest_file.write_text(json.dumps(manifest))
+    with pytest.raises(ValueError, match='list of "jobs"'):
+        read_manifest(str(manifest_file))
+
+def test_options_to_argv():
+    assert options_to_argv({'neural': True, 'quiet': False, 'voice': 'Joanna',
+                            'subtitle_formats': ['vtt', 'srt'],
+                            'pages': None, 'tts_max_chars': 1500}) == \
+        ['--neural', '--voice', 'Joanna', '--subtitle_formats', 'vtt,srt',
+         '--tts_max_chars', '1500']
+
+def test_job_options_override_manifest_options():
+    manifest = {'options': {'voice': 'Joanna', 'neural': True}, 'jobs': []}
+    job = dict(JOB, options={'voice': 'Matthew'})
+    assert job_argv(manifest, job) == \
+        ['--voice', 'Matthew', '--neural', 'a.pdf', 'a.txt', 'a.mp4']
+
+def test_job_without_files():
+    with pytest.raises(ValueError, match='"script_file"'):
+        job_argv({}, {'pdf_file': 'a.pdf', 'output_file': 'a.mp4'})
+
+@pytest.mark.parametrize('name', ['jobs', 'tts_rate', 'profile', 'watch'])
+def test_batch_options_rejected(name):
+    with pytest.raises(ValueError, match=f'"{name}"'):
+        job_argv({'options': {name: 1}}, JOB)
+    with pytest.raises(ValueError, match=f'"{name}"'):
+        job_argv({}, dict(JOB, options={name: 1}))
@@ -0,0 +1,200 @@
+"""
+Tests for planning the builds and for concurrent builds sharing the worker
+pools and the cache. The builds run with stub tools and a fake TTS client,
+and once more with the real tools if the PDF tools, FFmpeg and espeak-ng
+are installed.
+Author: T. Junttila
+License: The MIT License
+"""
+
+from concurrent.futures import Future
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+
+import pytest
+
+from pdf2video import pdf2video
+from pdf2video.cache import CacheIndex
+from pdf2video.pdf2video import BuildPools, EspeakNG, build, encoder_plan, \
+    make_arg_parser
+
+TOOLS = ['pdfinfo', 'pdftoppm', 'ffmpeg', 'ffprobe', 'espeak-ng']
+SAMPLE_PDF = os.path.join(os.path.dirname(__file__), os.pardir, 'sample.pdf')
+
+# Stub tools writing the durations requested from FFmpeg as the
+# contents of its output files; the FFmpeg commands are logged
+STUBS = {
+    'pdfinfo': 'print("Pages: 2")',
+    'pdftoppm': '''
+first = int(sys.argv[sys.argv.index('-f')+1])
+last = int(sys.argv[sys.argv.index('-l')+1])
+for page_num in range(first, last+1):
+    with open(f'{sys.argv[-1]}-{page_num}.png', 'wb') as file_handle:
+        file_handle.write(b'png')
+''',
+    'ffmpeg': '''
+with open(os.path.join(os.path.dirname(sys.argv[0]), 'ffmpeg.log'), 'a') as f:
+    f.write(' '.join(sys.argv[1:]) + '\\n')
+duration = sys.argv[sys.argv.index('-t')+1] if '-t' in sys.argv else '0'
+with open(sys.argv[-1], 'w') as file_handle:
+    file_handle.write(duration)
+''',
+    'ffprobe': '''
+with open(sys.argv[-1]) as file_handle:
+    print(file_handle.read())
+'''}
+
+# A MPEG 1 Layer III frame of 1152 samples at 44100 Hz
+MP3_FRAME = bytes([0xff, 0xfb, 0x90, 0x00]) + bytes(144 * 128000 // 44100 - 4)
+
+class FakeTTS:
+    """A TTS client speaking each line of the script for a second."""
+    def __init__(self):
+        self.requests = []
+        self.lock = threading.Lock()
+    def synthesize(self, ssml, output_file, speech_mark_types=None):
+        with self.lock:
+            self.requests.append(speech_mark_types is not None)
+        marks = re.findall(r'<mark name="([se]\d+)"/>', ssml)
+        if speech_mark_types:
+            with open(output_file, 'w', encoding='utf-8') as file_handle:
+                for (number, mark) in enumerate(marks):
+                    millis = 1000 * (number // 2) + (900 if number % 2 else 0)
+                    file_handle.write(json.dumps({'time': millis,
+                                                  'type': 'ssml',
+                                                  'value': mark}) + '\n')
+        else:
+            with open(output_file, 'wb') as file_handle:
+                file_handle.write(MP3_FRAME * (40 * max(1, len(marks) // 2)))
+
+SCRIPT = '''#page
+Welcome to a *short* test.
+#5
+
+#page second
+This is the second page.
+'''
+
+def test_encoder_plan(monkeypatch):
+    monkeypatch.setattr(pdf2video, 'cpu_count', lambda: 8)
+    # One encoder per CPU, but not more than there are segments
+    assert encoder_plan(0, 20) == (8, 1)
+    assert encoder_plan(0, 2) == (2, 4)
+    assert encoder_plan(3, 20) == (3, 2)
+    assert encoder_plan(16, 20) == (16, 1)
+    assert encoder_plan(0, 0) == (1, 8)
+
+def test_shared_task_made_once():
+    pools = BuildPools(1, 1, 0, 1)
+    made = []
+    def make():
+        made.append(True)
+        # Making a task can use the other shared tasks and file locks
+        with pools.file_lock('x.mp4'):
+            pools.shared_task('other', Future)
+        return Future()
+    first = pools.shared_task('key', make)
+    second = pools.shared_task('key', make)
+    assert second is first and len(made) == 1
+    pools.tasks['other'].set_result(None)
+    pools.shutdown()
+
+def test_shared_task_result_and_forgetting():
+    pools = BuildPools(1, 1, 0, 1)
+    inner = Future()
+    task = pools.shared_task('key', lambda: inner)
+    assert not task.done()
+    inner.set_result(42)
+    assert task.result() == 42
+    # A finished task is not shared any more
+    assert pools.shared_task('key', Future) is not task
+    pools.shutdown()
+
+def test_shared_task_failing_make():
+    pools = BuildPools(1, 1, 0, 1)
+    def make():
+        raise ValueError('broken')
+    with pytest.raises(ValueError):
+        pools.shared_task('key', make)
+    assert 'key' not in pools.tasks
+    pools.shutdown()
+
+def run_builds(tmp_path, options, nof_builds=2):
+    """
+    Build the script concurrently into the numbered videos with the shared
+    pools and cache, and check the results.
+    """
+    script_file = tmp_path / 'script.txt'
+    script_file.write_text(SCRIPT)
+    cache_dir = str(tmp_path / 'cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    cache = CacheIndex(cache_dir)
+    pools = BuildPools(2, 2, 0, 2)
+    builds = []
+    errors = []
+    for number in range(nof_builds):
+        args = make_arg_parser().parse_args(options + [
+            '--pages', '1-2', '--quiet', '--audio_cache', cache_dir,
+            '--temp_prefix', str(tmp_path / f'temp-{number}'),
+            SAMPLE_PDF, str(script_file), str(tmp_path / f'{number}.mp4')])
+        def run(args=args):
+            try:
+                build(args, pools, cache)
+            except Exception as err:
+                errors.append(err)
+        builds.append(threading.Thread(target=run))
+    for thread in builds:
+        thread.start()
+    for thread in builds:
+        thread.join()
+    pools.shutdown()
+    assert errors == []
+    for number in range(nof_builds):
+        assert os.path.getsize(tmp_path / f'{number}.mp4') > 0
+        assert (tmp_path / f'{number}.vtt').read_text().count('-->') == 2
+    for (_, _, file_names) in os.walk(cache_dir):
+        assert not any('.part' in file_name for file_name in file_names)
+    cache.save()
+    assert all(os.path.isfile(cache.path(name)) for name in cache.entries)
+
+@pytest.mark.skipif(os.name != 'posix', reason='needs executable scripts')
+def test_builds_with_stub_tools(tmp_path, monkeypatch):
+    tools_dir = tmp_path / 'tools'
+    tools_dir.mkdir()
+    options = []
+    for (tool, source) in STUBS.items():
+        tool_file = tools_dir / tool
+        tool_file.write_text(f'#!{sys.executable}\nimport os, sys\n{source}')
+        tool_file.chmod(0o755)
+        options += [f'--{tool}', str(tool_file)]
+    client = FakeTTS()
+    monkeypatch.setattr(pdf2video, 'make_polly_client', lambda *args: client)
+    run_builds(tmp_path, options)
+    # One audio and one speech marks request per page over both builds
+    assert sorted(client.requests) == [False, False, True, True]
+    log = (tools_dir / 'ffmpeg.log').read_text().splitlines()
+    assert len(log) == 4
+    # Both segments and the subtitles of the whole video are combined
+    assert all('-f concat' in cmd and '-map 1:s' in cmd for cmd in log[2:])
+    # The second round of builds finds all the segments in the cache
+    client.requests.clear()
+    run_builds(tmp_path, options)
+    assert client.requests == []
+    assert len((tools_dir / 'ffmpeg.log').read_text().splitlines()) == 6
+
+@pytest.mark.skipif(any(shutil.which(tool) is None for tool in TOOLS),
+                    reason='needs ' + ', '.join(TOOLS))
+def test_builds_with_tools(tmp_path, monkeypatch):
+    requests = []
+    synthesize = EspeakNG.synthesize
+    def counting_synthesize(client, ssml, output_file, speech_mark_types=None):
+        requests.append(speech_mark_types is not None)
+        synthesize(client, ssml, output_file, speech_mark_types)
+    monkeypatch.setattr(EspeakNG, 'synthesize', counting_synthesize)
+    run_builds(tmp_path, ['--tts', 'espeak-ng'])
+    # One audio and one speech marks request per page over both builds
+    assert sorted(requests) == [False, False, True, True]
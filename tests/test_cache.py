@@ -0,0 +1,106 @@
+"""
+Tests for the cache index.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import json
+import multiprocessing
+import os
+
+from pdf2video.cache import INDEX_FILE, CacheIndex
+
+def add_file(cache, name, size, atime=None):
+    with open(cache.path(name), 'wb') as file_handle:
+        file_handle.write(bytes(size))
+    cache.add(name, 'test')
+    if atime is not None:
+        cache.entries[name]['atime'] = atime
+
+def saved_names(directory):
+    with open(os.path.join(directory, INDEX_FILE), 'r', encoding='utf-8') as f:
+        return set(json.load(f)['entries'])
+
+def test_gc_evicts_least_recently_used(tmp_path):
+    cache = CacheIndex(str(tmp_path))
+    for (number, name) in enumerate(['a', 'b', 'c', 'd']):
+        add_file(cache, name, 100, atime=1000 + number)
+    evicted = cache.gc(max_size=250, keep={'a'})
+    assert evicted == ['b', 'c']
+    assert cache.total_size() == 200
+    assert not os.path.exists(cache.path('b'))
+    assert os.path.exists(cache.path('a'))
+
+def test_gc_evicts_old_files(tmp_path):
+    cache = CacheIndex(str(tmp_path))
+    add_file(cache, 'old', 10, atime=0)
+    add_file(cache, 'new', 10)
+    assert cache.gc(max_age=3600) == ['old']
+    assert cache.lookup('new') and not cache.lookup('old')
+
+def test_save_merges_other_indices(tmp_path):
+    first = CacheIndex(str(tmp_path))
+    second = CacheIndex(str(tmp_path))
+    add_file(first, 'a', 10)
+    add_file(second, 'b', 10)
+    first.save()
+    second.save()
+    assert saved_names(str(tmp_path)) == {'a', 'b'}
+    assert set(CacheIndex(str(tmp_path)).entries) == {'a', 'b'}
+
+def test_save_does_not_resurrect_evicted(tmp_path):
+    first = CacheIndex(str(tmp_path))
+    add_file(first, 'a', 10)
+    add_file(first, 'b', 10)
+    first.save()
+    # Another process evicts a file and saves its index
+    second = CacheIndex(str(tmp_path))
+    second.remove('a')
+    second.save()
+    first.save()
+    assert saved_names(str(tmp_path)) == {'b'}
+
+def test_verify_drops_removed_file(tmp_path):
+    cache = CacheIndex(str(tmp_path))
+    add_file(cache, 'a', 10)
+    add_file(cache, 'b', 10)
+    os.unlink(cache.path('a'))
+    # The lookups only consult the index
+    assert cache.lookup('a')
+    assert cache.verify() == ['a']
+    assert not cache.lookup('a') and cache.lookup('b')
+    cache.save()
+    assert saved_names(str(tmp_path)) == {'b'}
+
+def test_save_keeps_newer_access_times(tmp_path):
+    first = CacheIndex(str(tmp_path))
+    add_file(first, 'a', 10, atime=100)
+    first.save()
+    second = CacheIndex(str(tmp_path))
+    assert second.lookup('a')
+    second.save()
+    first.save()
+    assert CacheIndex(str(tmp_path)).entries['a']['atime'] > 100
+
+def test_missing_index_is_rebuilt(tmp_path):
+    (tmp_path / 'pages').mkdir()
+    (tmp_path / 'pages' / 'x.png').write_bytes(bytes(5))
+    (tmp_path / 'y.mp3.123.part').write_bytes(bytes(5))
+    cache = CacheIndex(str(tmp_path))
+    assert set(cache.entries) == {os.path.join('pages', 'x.png')}
+
+def add_and_save(directory, prefix):
+    cache = CacheIndex(directory)
+    for number in range(20):
+        add_file(cache, f'{prefix}{number}', 1)
+        cache.save()
+
+def test_concurrent_saves_keep_all_entries(tmp_path):
+    processes = [multiprocessing.Process(target=add_and_save,
+                                         args=(str(tmp_path), prefix))
+                 for prefix in 'abcd']
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert len(saved_names(str(tmp_path))) == 80
@@ -0,0 +1,51 @@
+"""
+Tests for the HLS playlists and the WebVTT segments.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import os
+
+from pdf2video.hls import read_media_playlist, write_master_playlist, \
+    write_media_playlist, write_vtt_segment
+from pdf2video.subtitles import Cue
+
+def read(file_name):
+    with open(file_name, 'r', encoding='utf-8') as file_handle:
+        return file_handle.read()
+
+def test_media_playlist(tmp_path):
+    playlist = str(tmp_path / 'media.m3u8')
+    segments = [(4.2, 'a.ts'), (10.0, 'b.ts')]
+    write_media_playlist(playlist, 10, segments, False)
+    text = read(playlist)
+    assert '#EXT-X-TARGETDURATION:10\n' in text
+    assert '#EXT-X-ENDLIST' not in text
+    assert read_media_playlist(playlist) == segments
+    write_media_playlist(playlist, 10, segments + [(1.5, 'c.ts')], True)
+    assert read(playlist).endswith('#EXT-X-ENDLIST\n')
+    assert read_media_playlist(playlist)[-1] == (1.5, 'c.ts')
+    assert os.listdir(str(tmp_path)) == ['media.m3u8']
+
+def test_master_playlist(tmp_path):
+    playlist = str(tmp_path / 'master.m3u8')
+    write_master_playlist(playlist, 'media.m3u8')
+    assert read(playlist).splitlines()[-2:] == \
+        ['#EXT-X-STREAM-INF:BANDWIDTH=2000000', 'media.m3u8']
+    write_master_playlist(playlist, 'media.m3u8', 'subs.m3u8')
+    text = read(playlist)
+    assert 'TYPE=SUBTITLES' in text and 'URI="subs.m3u8"' in text
+    assert ',SUBTITLES="subs"\nmedia.m3u8\n' in text
+
+def test_vtt_segment(tmp_path):
+    vtt_file = str(tmp_path / 'a.vtt')
+    cues = [Cue(0, 900, 'first'), Cue(900, 2100, 'second'),
+            Cue(2500, 3000, 'third')]
+    write_vtt_segment(cues, 1000, 2000, vtt_file)
+    text = read(vtt_file)
+    assert text.startswith('WEBVTT\nX-TIMESTAMP-MAP=MPEGTS:126000,')
+    assert 'second' in text and 'first' not in text and 'third' not in text
+    # An unchanged segment is not rewritten
+    os.utime(vtt_file, (0, 0))
+    write_vtt_segment(cues, 1000, 2000, vtt_file)
+    assert os.path.getmtime(vtt_file) == 0
@@ -0,0 +1,60 @@
+"""
+Tests for reading and concatenating MP3 files.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import pytest
+
+from pdf2video.mp3 import concatenate_mp3, mp3_duration, mp3_frames
+
+# A MPEG 1 Layer III frame header: 128 kbit/s, 44100 Hz, no padding
+MPEG1_HEADER = bytes([0xff, 0xfb, 0x90, 0x00])
+MPEG1_LENGTH = 144 * 128000 // 44100
+# A MPEG 2 Layer III frame header: 64 kbit/s, 22050 Hz, no padding
+MPEG2_HEADER = bytes([0xff, 0xf3, 0x80, 0x00])
+MPEG2_LENGTH = 72 * 64000 // 22050
+
+def frames(count, header=MPEG1_HEADER, length=MPEG1_LENGTH):
+    return (header + bytes(length - len(header))) * count
+
+def id3_tag():
+    # An ID3v2 tag with a 20 byte body, its size in the syncsafe format
+    return b'ID3\x04\x00\x00\x00\x00\x00\x14' + b'\xff' * 20
+
+def info_frame():
+    # A VBR header frame, which contains no audio
+    return MPEG1_HEADER + bytes(32) + b'Info' + \
+        bytes(MPEG1_LENGTH - len(MPEG1_HEADER) - 36)
+
+def test_frames():
+    data = id3_tag() + info_frame() + frames(3) + b'TAG' + bytes(125)
+    result = mp3_frames(data)
+    assert len(result) == 3
+    assert result[0] == (30 + MPEG1_LENGTH, MPEG1_LENGTH, 1152, 44100)
+    assert [pos for (pos, _, _, _) in result] == \
+        [30 + number * MPEG1_LENGTH for number in range(1, 4)]
+
+def test_mpeg2_frames():
+    result = mp3_frames(frames(2, MPEG2_HEADER, MPEG2_LENGTH))
+    assert [(samples, rate) for (_, _, samples, rate) in result] == \
+        [(576, 22050)] * 2
+
+def test_duration(tmp_path):
+    mp3_file = tmp_path / 'a.mp3'
+    mp3_file.write_bytes(id3_tag() + info_frame() + frames(100))
+    assert mp3_duration(str(mp3_file)) == pytest.approx(100 * 1152 / 44100)
+
+def test_concatenate(tmp_path):
+    input_files = []
+    for (number, count) in enumerate([10, 25, 1]):
+        input_file = tmp_path / f'{number}.mp3'
+        input_file.write_bytes(id3_tag() + info_frame() + frames(count))
+        input_files.append(str(input_file))
+    output_file = str(tmp_path / 'joined.mp3')
+    durations = concatenate_mp3(input_files, output_file)
+    assert durations == pytest.approx([count * 1152 / 44100
+                                       for count in [10, 25, 1]])
+    with open(output_file, 'rb') as file_handle:
+        assert file_handle.read() == frames(36)
+    assert mp3_duration(output_file) == pytest.approx(sum(durations))
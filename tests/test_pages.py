@@ -0,0 +1,63 @@
+"""
+Tests for identifying and rendering the PDF pages.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import pytest
+
+from pdf2video.pdf2video import page_batches, page_image_hashes, \
+    pdf_page_fingerprints
+
+def test_page_batches_join_contiguous_pages():
+    assert page_batches([3, 1, 2, 2, 7, 8, 10], 1) == [(1, 3), (7, 8), (10, 10)]
+    assert page_batches([], 4) == []
+    assert page_batches([5], 0) == [(5, 5)]
+
+def test_page_batches_split_for_workers():
+    assert page_batches(range(1, 9), 4) == [(1, 2), (3, 4), (5, 6), (7, 8)]
+    assert page_batches(range(1, 8), 3) == [(1, 3), (4, 6), (7, 7)]
+
+def write_pdf(file_name, second_width, link=True):
+    pypdf = pytest.importorskip('pypdf')
+    from pypdf.annotations import Link
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(200, 100)
+    writer.add_blank_page(second_width, 100)
+    if link:
+        # A link on the first page to the second one
+        writer.add_annotation(0, Link(rect=(0, 0, 50, 50),
+                                      target_page_index=1))
+    with open(file_name, 'wb') as file_handle:
+        writer.write(file_handle)
+
+def test_fingerprints_of_changed_page(tmp_path):
+    first = str(tmp_path / 'first.pdf')
+    second = str(tmp_path / 'second.pdf')
+    write_pdf(first, 200)
+    write_pdf(second, 300)
+    (old, new) = (pdf_page_fingerprints(first, [1, 2]),
+                  pdf_page_fingerprints(second, [1, 2]))
+    # The link destination does not bring the second page into the first one
+    assert old[1] == new[1]
+    assert old[2] != new[2]
+
+def test_fingerprints_of_annotations(tmp_path):
+    linked = str(tmp_path / 'linked.pdf')
+    plain = str(tmp_path / 'plain.pdf')
+    write_pdf(linked, 200)
+    write_pdf(plain, 200, link=False)
+    assert pdf_page_fingerprints(linked, [1])[1] != \
+        pdf_page_fingerprints(plain, [1])[1]
+
+def test_unreadable_pdf_falls_back(tmp_path):
+    pytest.importorskip('pypdf')
+    pdf_file = tmp_path / 'broken.pdf'
+    pdf_file.write_bytes(b'not a PDF file')
+    messages = []
+    assert pdf_page_fingerprints(str(pdf_file), [1], messages.append) is None
+    assert len(messages) == 1
+    hashes = page_image_hashes(str(pdf_file), [1, 2], 1080, messages.append)
+    assert len(set(hashes.values())) == 2
+    assert page_image_hashes(str(pdf_file), [1], 720, messages.append)[1] != \
+        hashes[1]
@@ -0,0 +1,67 @@
+"""
+Tests for the script parser against the original implementation.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import random
+
+import pytest
+
+import original_parser
+from pdf2video.parser import ParseError, parse, parse_to_ast
+
+LINES = [
+    '',
+    'Hello world.',
+    'Welcome to a short sample presentation about the '
+    '#sub#pdf-to-video#pdf2video# tool.',
+    'Tired in spending *hours* in recording and editing the audio tracks?',
+    'It costs -5 euros: "really", yes; no!',
+    '#slow/read this slowly/ and #low|this low| and #high!this high!',
+    '#ph/tomato/t@meItoU/ and @HTML@ #12 done.',
+    '#sub/#slow|a b|/AB/ *#high/x y/* \t spaces',
+    '*#low/nested low/ words*',
+]
+
+TOKENS = ['word', 'Another', ' ', '\t', ', ', '. ', '!', '"', '-', '-42',
+          '*emph*', '*two words*', '#5', '#10', '@abc@', '#slow/s t/',
+          '#low/l/', '#high/h *e*/', '#sub/a b/AB/', '#sub|x|y z|',
+          '#ph/to/t@/']
+
+def random_lines(count, seed=1):
+    rand = random.Random(seed)
+    return [''.join(rand.choice(TOKENS) for _ in range(rand.randint(1, 12)))
+            for _ in range(count)]
+
+def original_parse(string, neural):
+    # The original parse() before the single-pass emit()
+    ast = original_parser.parse_to_ast(string)
+    ssml = ''.join([node.to_ssml(neural) for node in ast])
+    words = []
+    for node in ast:
+        words += node.to_words()
+    sub = ''.join([node.to_sub() for node in ast])
+    return (ssml, words, sub)
+
+@pytest.mark.parametrize('neural', [False, True])
+def test_parse_matches_original(neural):
+    for line in LINES + random_lines(300):
+        assert parse(line, neural) == original_parse(line, neural), line
+
+@pytest.mark.parametrize('neural', [False, True])
+def test_nodes_match_original(neural):
+    for line in LINES + random_lines(100, seed=2):
+        nodes = parse_to_ast(line)
+        original_nodes = original_parser.parse_to_ast(line)
+        assert len(nodes) == len(original_nodes)
+        for (node, original) in zip(nodes, original_nodes):
+            assert node.to_ssml(neural) == original.to_ssml(neural)
+            assert node.to_words() == original.to_words()
+            assert node.to_sub() == original.to_sub()
+
+@pytest.mark.parametrize('line', ['Malformed *emphasis', '#sub/a/',
+                                  '#unknown', '@open', '#slow/x'])
+def test_malformed_line(line):
+    with pytest.raises(ParseError, match='^On line 7: '):
+        parse(line, False, 7)
@@ -0,0 +1,64 @@
+"""
+Tests for the task scheduler.
+Author: T. Junttila
+License: The MIT License
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+from pdf2video.scheduler import Scheduler
+
+def test_dependencies_run_first():
+    scheduler = Scheduler()
+    order = []
+    lock = threading.Lock()
+    def step(name, delay=0):
+        time.sleep(delay)
+        with lock:
+            order.append(name)
+        return name
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first = scheduler.add(executor, step, ('first', 0.05))
+        second = scheduler.add(executor, step, ('second', 0.02))
+        joined = scheduler.add(None, step, ('joined',), [first, second])
+        last = scheduler.add(executor, step, ('last',), [joined])
+        scheduler.wait()
+    assert order[2:] == ['joined', 'last']
+    assert set(order[:2]) == {'first', 'second'}
+    assert last.result() == 'last'
+
+def test_inline_task_without_dependencies():
+    scheduler = Scheduler()
+    task = scheduler.add(None, lambda: 42)
+    assert task.done() and task.result() == 42
+
+def test_failure_propagates_to_dependents():
+    scheduler = Scheduler()
+    ran = []
+    def fail():
+        raise ValueError('broken')
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        failed = scheduler.add(executor, fail)
+        other = scheduler.add(executor, lambda: ran.append('other'))
+        dependent = scheduler.add(executor, lambda: ran.append('dependent'),
+                                  (), [failed, other])
+        indirect = scheduler.add(None, lambda: ran.append('indirect'),
+                                 (), [dependent])
+        with pytest.raises(ValueError, match='broken'):
+            scheduler.wait()
+    assert ran == ['other']
+    assert dependent.exception() is failed.exception()
+    assert indirect.exception() is failed.exception()
+
+def test_shut_down_executor_fails_the_task():
+    scheduler = Scheduler()
+    executor = ThreadPoolExecutor(max_workers=1)
+    executor.shutdown()
+    task = scheduler.add(executor, lambda: None)
+    with pytest.raises(RuntimeError):
+        scheduler.wait()
+    assert isinstance(task.exception(), RuntimeError)
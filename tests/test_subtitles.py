@@ -0,0 +1,39 @@
+"""
+Tests for the line timings of the subtitles.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import json
+
+from pdf2video.subtitles import join_timings, read_speech_marks, \
+    read_timings, write_timings
+
+def test_join_timings():
+    first = [(200, 1000), (1100, 2000), None]
+    second = [None, None, (0, 500), (600, 900)]
+    third = [None, None, None, None, None]
+    assert join_timings([first, second, third], [0, 2500, 4000]) == \
+        [(200, 1000), (1100, 2000), (2500, 3000), (3100, 3400)]
+
+def test_join_timings_keeps_untimed_lines():
+    assert join_timings([[None, (10, 20)], [None, None, None, (0, 5)]],
+                        [0, 100]) == [None, (10, 20), None, (100, 105)]
+
+def test_join_single_chunk():
+    timings = [(0, 10), None, (20, 30)]
+    assert join_timings([timings], [0]) == timings
+
+def test_speech_marks_to_timings(tmp_path):
+    marks_file = tmp_path / 'a.mrk'
+    marks = [{'time': 200, 'type': 'ssml', 'value': 's0'},
+             {'time': 250, 'type': 'word', 'value': 'Hello'},
+             {'time': 900, 'type': 'ssml', 'value': 'e0'},
+             {'time': 1000, 'type': 'ssml', 'value': 's2'},
+             {'time': 1500, 'type': 'ssml', 'value': 'e2'}]
+    marks_file.write_text(''.join(json.dumps(mark)+'\n' for mark in marks))
+    timings = read_speech_marks(str(marks_file))
+    assert timings == [(200, 900), None, (1000, 1500)]
+    timings_file = str(tmp_path / 'a.tim')
+    write_timings(timings, timings_file)
+    assert read_timings(timings_file) == timings
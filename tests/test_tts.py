@@ -0,0 +1,93 @@
+"""
+Tests for the rate limiting and the retries of the TTS requests.
+Author: T. Junttila
+License: The MIT License
+"""
+
+import os
+
+import pytest
+
+from pdf2video import tts
+from pdf2video.tts import TTSError, TokenBucket, is_throttling_error, \
+    synthesize
+
+class FakeClock:
+    """A clock advanced only by sleeping."""
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+    def monotonic(self):
+        return self.now
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(tts.time, 'monotonic', fake.monotonic)
+    monkeypatch.setattr(tts.time, 'sleep', fake.sleep)
+    return fake
+
+class FakeClient:
+    """A TTS client failing with the given errors before succeeding."""
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+    def synthesize(self, ssml, output_file, speech_mark_types=None):
+        self.calls += 1
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        with open(output_file, 'w', encoding='utf-8') as file_handle:
+            file_handle.write(ssml)
+
+def test_token_bucket_limits_rate(clock):
+    bucket = TokenBucket(2)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == pytest.approx([0.5, 0.5])
+
+def test_token_bucket_burst(clock):
+    bucket = TokenBucket(1, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert sum(clock.sleeps) == pytest.approx(1)
+
+def test_token_bucket_unlimited(clock):
+    bucket = TokenBucket(0)
+    for _ in range(10):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+def test_throttled_request_retried_with_backoff(clock, tmp_path):
+    output_file = str(tmp_path / 'a.mp3')
+    client = FakeClient([TTSError('Rate exceeded', throttled=True)] * 3)
+    messages = []
+    synthesize(client, ('<speak/>', output_file, None), None, backoff=1,
+               verbose=messages.append)
+    assert client.calls == 4 and len(messages) == 3
+    # Exponential backoff with random jitter of up to the delay itself
+    for (attempt, delay) in enumerate(clock.sleeps):
+        assert 2 ** attempt <= delay <= 2 ** (attempt+1)
+    assert os.path.isfile(output_file)
+
+def test_throttled_request_gives_up(clock, tmp_path):
+    client = FakeClient([TTSError('Rate exceeded', throttled=True)] * 3)
+    with pytest.raises(TTSError):
+        synthesize(client, ('<speak/>', str(tmp_path / 'a.mp3'), None), None,
+                   retries=2, verbose=lambda msg: None)
+    assert client.calls == 3 and len(clock.sleeps) == 2
+
+def test_failed_request_not_retried(clock, tmp_path):
+    client = FakeClient([TTSError('Invalid SSML')])
+    with pytest.raises(TTSError, match='Invalid SSML'):
+        synthesize(client, ('<speak/>', str(tmp_path / 'a.mp3'), None),
+                   TokenBucket(0), verbose=lambda msg: None)
+    assert client.calls == 1 and clock.sleeps == []
+
+def test_throttling_errors():
+    assert is_throttling_error('An error occurred (ThrottlingException)')
+    assert not is_throttling_error('An error occurred (InvalidSsmlException)')